@@ -0,0 +1,22 @@
+"""Object size measurement on an A4 sheet with OpenCV.
+
+matplotlib is only imported by `show_image`, so importing the package (and
+starting batch workers) costs just OpenCV and NumPy.
+"""
+from .batch import list_images, measure_batch, measure_pipeline
+from .cache import ResultCache, measure_size_cached
+from .core import (PAPER_H, PAPER_W, SCALE, PaperNotFoundError, detect_paper, find_contours,
+                   find_paper, load_image, map_frame, measure_size, preprocess_image,
+                   reorder_coords, show_image, warp_image)
+from .profiling import StageProfiler
+from .sheets import measure_sheets
+from .store import ResultStore
+from .stream import measure_stream, stream_stats
+from .tuning import CameraProfiles, measure_size_auto
+
+__all__ = ['PAPER_H', 'PAPER_W', 'SCALE', 'CameraProfiles', 'PaperNotFoundError',
+           'ResultCache', 'ResultStore', 'StageProfiler', 'detect_paper', 'find_contours',
+           'find_paper', 'list_images', 'load_image', 'map_frame', 'measure_batch',
+           'measure_pipeline', 'measure_sheets', 'measure_size', 'measure_size_auto',
+           'measure_size_cached', 'measure_stream', 'preprocess_image', 'reorder_coords',
+           'show_image', 'stream_stats', 'warp_image']
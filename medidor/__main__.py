@@ -0,0 +1,215 @@
+"""Command line entry point: python -m medidor <command> ..."""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+from .batch import IMAGE_PATTERNS, measure_batch, measure_pipeline
+from .bench import benchmark_paths, measure_import_time, run_benchmark
+from .cache import ResultCache
+from .core import measure_size
+from .server import start_server, stop_server
+from .store import ResultStore
+from .stream import measure_stream, stream_stats
+
+
+def _measure_kwargs(args):
+    return {'img_original_scale': args.scale,
+            'paper_eps_param'   : args.paper_eps,
+            'objects_eps_param' : args.objects_eps,
+            'reduced_decode'    : args.reduced_decode,
+            'pyramid'           : args.pyramid,
+            'frame_shape'       : args.frame_shape}
+
+
+def _frame_shape(value):
+    height, width = value.lower().split('x')
+    return int(height), int(width)
+
+
+def _add_measure_options(parser):
+    parser.add_argument('--scale', type=float, default=0.7)
+    parser.add_argument('--paper-eps', type=float, default=0.04)
+    parser.add_argument('--objects-eps', type=float, default=0.05)
+    parser.add_argument('--reduced-decode', action='store_true')
+    parser.add_argument('--pyramid', action='store_true')
+    parser.add_argument('--frame-shape', type=_frame_shape, default=None,
+                        help='HEIGHTxWIDTH of raw .bgr/.raw frames')
+
+
+def _print_sizes(path, sizes_mm):
+    print(path)
+    for i, (height, width) in enumerate(sizes_mm):
+        print(f'  object {i}: {height:.1f} x {width:.1f} mm (height x width)')
+
+
+def cmd_measure(args):
+    kwargs = _measure_kwargs(args)
+    for path in args.images:
+        if args.output:
+            img_result, sizes_mm = measure_size(path, return_sizes=True, **kwargs)
+            name = os.path.splitext(os.path.basename(path))[0] + '_result.jpg'
+            os.makedirs(args.output, exist_ok=True)
+            cv2.imwrite(os.path.join(args.output, name), img_result)
+        else:
+            sizes_mm = measure_size(path, draw=False, **kwargs)['sizes_mm']
+        _print_sizes(path, sizes_mm)
+
+
+def cmd_batch(args):
+    kwargs = _measure_kwargs(args)
+    pattern = args.pattern or IMAGE_PATTERNS
+    if args.threads:
+        results, errors = measure_pipeline(args.source, output_dir=args.output,
+                                           pattern=pattern, **kwargs)
+    else:
+        cache = ResultCache(args.cache) if args.cache else None
+        store = ResultStore(args.store) if args.store else None
+        try:
+            results, errors = measure_batch(args.source, pattern=pattern,
+                                            max_workers=args.workers, cache=cache,
+                                            store=store, job=args.job, **kwargs)
+        finally:
+            if store is not None:
+                store.close()
+    for path in sorted(results):
+        _print_sizes(path, results[path])
+    for record in errors:
+        print(f"{record['path']}: {record['error']}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_stream(args):
+    source = int(args.source) if args.source.isdigit() else args.source    #1
+    records = []
+    try:
+        for record in measure_stream(source, img_original_scale=args.scale,
+                                     paper_eps_param=args.paper_eps,
+                                     objects_eps_param=args.objects_eps,
+                                     pyramid=args.pyramid, max_frames=args.max_frames):
+            records.append(record)
+            if args.verbose:
+                print(record['frame'], record.get('sizes_mm', record.get('error')))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(stream_stats(records), indent=2, default=float))
+
+
+def cmd_query(args):
+    since = time.time() - args.days * 86400 if args.days is not None else None
+    with ResultStore(args.store) as store:
+        rows = store.query(since=since, min_width=args.min_width, max_width=args.max_width,
+                           min_height=args.min_height, max_height=args.max_height,
+                           job=args.job)
+    for row in rows:
+        measured_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['measured_at']))
+        print(f"{measured_at}  {row['path']}  object {row['object']}: "
+              f"{row['height_mm']:.1f} x {row['width_mm']:.1f} mm")
+    print(f'{len(rows)} objects', file=sys.stderr)
+
+
+def cmd_benchmark(args):
+    if args.import_time:
+        print(f'import medidor: {measure_import_time()} ms')
+        print(f'import medidor + matplotlib: '
+              f"{measure_import_time('import medidor, matplotlib.pyplot')} ms")
+        return 0
+    try:
+        metrics, _ = run_benchmark(args.baseline, paths=args.images or benchmark_paths(),
+                                   threshold=args.threshold, update=args.update,
+                                   repeat=args.repeat)
+    except AssertionError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(metrics, indent=2))
+    return 0
+
+
+def cmd_serve(args):
+    server, service = start_server(args.host, args.port, workers=args.workers,
+                                   max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                   request_timeout=args.timeout)
+    host, port = server.server_address[:2]
+    print(f'listening on http://{host}:{port} (POST /measure, GET /metrics)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_server(server, service)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='medidor', 
+                                     description='Measure objects on an A4 sheet.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    measure = commands.add_parser('measure', help='measure one or more images')
+    measure.add_argument('images', nargs='+')
+    measure.add_argument('-o', '--output', help='directory for the annotated images')
+    _add_measure_options(measure)
+    measure.set_defaults(func=cmd_measure)
+    
+    batch = commands.add_parser('batch', help='measure every image in a directory')
+    batch.add_argument('source')
+    batch.add_argument('--pattern', action='append',
+                       help='glob inside SOURCE, repeatable (default: JPEGs and '
+                            '.npy/.raw/.bgr frames)')
+    batch.add_argument('--workers', type=int, default=None)
+    batch.add_argument('--threads', action='store_true', 
+                       help='threaded pipeline instead of the process pool')
+    batch.add_argument('-o', '--output', help='results directory (threaded pipeline)')
+    batch.add_argument('--cache', help='result cache directory (process pool)')
+    batch.add_argument('--store', help='SQLite results store (process pool)')
+    batch.add_argument('--job', help='job name recorded in the store')
+    _add_measure_options(batch)
+    batch.set_defaults(func=cmd_batch)
+    
+    stream = commands.add_parser('stream', help='measure a video file or camera index')
+    stream.add_argument('source')
+    stream.add_argument('--max-frames', type=int, default=None)
+    stream.add_argument('-v', '--verbose', action='store_true')
+    _add_measure_options(stream)
+    stream.set_defaults(func=cmd_stream)
+    
+    query = commands.add_parser('query', help='search a results store')
+    query.add_argument('store')
+    query.add_argument('--days', type=float, default=None, help='only the last N days')
+    query.add_argument('--min-width', type=float)
+    query.add_argument('--max-width', type=float)
+    query.add_argument('--min-height', type=float)
+    query.add_argument('--max-height', type=float)
+    query.add_argument('--job')
+    query.set_defaults(func=cmd_query)
+    
+    benchmark = commands.add_parser('benchmark', help='compare against a baseline')
+    benchmark.add_argument('images', nargs='*')
+    benchmark.add_argument('--baseline', default='benchmark_baseline.json')
+    benchmark.add_argument('--threshold', type=float, default=0.25)
+    benchmark.add_argument('--repeat', type=int, default=3)
+    benchmark.add_argument('--update', action='store_true')
+    benchmark.add_argument('--import-time', action='store_true', 
+                           help='only time the package import')
+    benchmark.set_defaults(func=cmd_benchmark)
+    
+    serve = commands.add_parser('serve', help='local HTTP measurement service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int, default=2)
+    serve.add_argument('--max-batch', type=int, default=8)
+    serve.add_argument('--max-wait-ms', type=float, default=5)
+    serve.add_argument('--timeout', type=float, default=30,
+                       help='seconds before a request is answered with 503')
+    serve.set_defaults(func=cmd_serve)
+    
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
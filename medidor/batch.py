@@ -0,0 +1,201 @@
+"""Batch measurement over image directories: process pool and threaded pipeline."""
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from .cache import ResultCache, measure_size_cached
+from .core import FRAME_EXTENSIONS, load_image, measure_size
+from .profiling import StageProfiler
+from .store import image_hash
+
+
+# What a directory source is searched for: JPEGs and raw frame files.
+IMAGE_PATTERNS = ('*.jp*g',) + tuple('*' + extension for extension in FRAME_EXTENSIONS)
+
+
+def list_images(source, pattern=IMAGE_PATTERNS):
+    if isinstance(source, (list, tuple)):
+        paths = list(source)
+    elif os.path.isdir(source):
+        patterns = [pattern] if isinstance(pattern, str) else pattern
+        paths = {path for pattern in patterns               #1
+                 for path in glob.glob(os.path.join(source, pattern))}
+    else:
+        paths = glob.glob(source)                           #2
+    return sorted(paths)
+
+
+_worker_buffers = {}
+
+
+def _measure_job(job):
+    path, kwargs, profile, cache_args, keep_corners = job
+    profiler = StageProfiler(track_memory=profile) if profile is not None else None
+    cache = ResultCache(*cache_args) if cache_args else None
+    try:
+        if cache is not None:
+            result = measure_size_cached(path, cache, buffers=_worker_buffers,
+                                         profiler=profiler, **kwargs)
+        else:
+            result = measure_size(path, draw=False, buffers=_worker_buffers, 
+                                  profiler=profiler, **kwargs)
+        record = {'path': path, 'sizes_mm': result['sizes_mm']}
+        if keep_corners:
+            record.update({'paper_corners': result['paper_corners'],
+                           'image_hash'   : image_hash(path),
+                           'measured_at'  : time.time()})
+    except Exception as e:    #3
+        record = {'path': path, 'error': type(e).__name__, 'message': str(e)}
+    if profiler is not None:
+        record['profile'] = profiler.records
+    if cache is not None:
+        record['cache_hit'] = cache.hits > 0
+    return record
+
+
+def measure_batch(source, pattern=IMAGE_PATTERNS, max_workers=None, 
+                  chunksize=1, overrides=None, profiler=None, cache=None, 
+                  store=None, job=None, **measure_kwargs):
+    overrides = overrides or {}
+    cache_args = (cache.directory, cache.max_bytes) if cache is not None else None
+    
+    jobs = []
+    for path in list_images(source, pattern):
+        kwargs = dict(measure_kwargs)
+        kwargs.update(overrides.get(os.path.basename(path), {}))    #4
+        # Worker profilers track memory when the caller's does, so the records merge.
+        profile = profiler.track_memory if profiler is not None else None
+        jobs.append((path, kwargs, profile, cache_args, store is not None))
+    
+    results = {}
+    errors  = []
+    stored  = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for record in executor.map(_measure_job, jobs, chunksize=chunksize):    #5
+            if profiler is not None:
+                profiler.merge(record.pop('profile'))
+            if cache is not None and 'cache_hit' in record:
+                if record.pop('cache_hit'):
+                    cache.hits += 1
+                else:
+                    cache.misses += 1
+            if 'error' in record:
+                errors.append(record)
+            else:
+                results[record['path']] = record['sizes_mm']
+                stored.append(record)
+    
+    # A single transaction for the whole job.
+    if store is not None:
+        store.add_results(stored, job=job)
+    return results, errors
+
+
+def measure_pipeline(source, output_dir=None, pattern=IMAGE_PATTERNS, readers=2, 
+                     workers=2, queue_size=8, img_original_scale=0.7,
+                     reduced_decode=False, overrides=None, **measure_kwargs):
+    overrides = overrides or {}
+    paths = list_images(source, pattern)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    # Bounded queues between stages: a full queue blocks the stage before it.
+    path_queue = queue.Queue()
+    decoded = queue.Queue(maxsize=queue_size)     #1
+    finished = queue.Queue(maxsize=queue_size)
+    for path in paths:
+        path_queue.put(path)
+    
+    def read():
+        while True:
+            try:
+                path = path_queue.get_nowait()
+            except queue.Empty:
+                return
+            kwargs = dict(measure_kwargs)
+            kwargs.update(overrides.get(os.path.basename(path), {}))
+            try:
+                img = load_image(path, scale=img_original_scale, 
+                                 reduced_decode=reduced_decode,
+                                 frame_shape=kwargs.get('frame_shape'),
+                                 frame_index=kwargs.get('frame_index', 0))    #2
+                decoded.put((path, img, None))
+            except Exception as e:
+                decoded.put((path, None, e))
+    
+    def compute():
+        buffers = {}
+        while True:
+            item = decoded.get()
+            if item is None:
+                return
+            path, img, error = item
+            if error is None:
+                kwargs = dict(measure_kwargs)
+                kwargs.update(overrides.get(os.path.basename(path), {}))
+                try:
+                    if output_dir is not None:
+                        img_result, sizes_mm = measure_size(path, img_original=img,
+                                                            buffers=buffers, 
+                                                            return_sizes=True, **kwargs)
+                    else:
+                        img_result = None
+                        sizes_mm = measure_size(path, img_original=img, buffers=buffers,
+                                                draw=False, **kwargs)['sizes_mm']
+                    finished.put((path, sizes_mm, img_result, None))    #3
+                    continue
+                except Exception as e:
+                    error = e
+            finished.put((path, None, None, error))
+    
+    def write():
+        log = None
+        if output_dir is not None:
+            log = open(os.path.join(output_dir, 'results.jsonl'), 'a')
+        try:
+            while True:
+                item = finished.get()
+                if item is None:
+                    return
+                path, sizes_mm, img_result, error = item
+                if error is not None:
+                    record = {'path': path, 'error': type(error).__name__, 
+                              'message': str(error)}
+                    errors.append(record)
+                else:
+                    record = {'path': path, 'sizes_mm': sizes_mm.tolist()}
+                    results[path] = sizes_mm
+                if log is not None:
+                    if img_result is not None:
+                        name = os.path.splitext(os.path.basename(path))[0] + '_result.jpg'
+                        cv2.imwrite(os.path.join(output_dir, name), img_result)    #4
+                    log.write(json.dumps(record) + '\n')
+        finally:
+            if log is not None:
+                log.close()
+    
+    results = {}
+    errors  = []
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    worker_threads = [threading.Thread(target=compute) for _ in range(workers)]
+    writer_thread = threading.Thread(target=write)
+    for thread in reader_threads + worker_threads + [writer_thread]:
+        thread.start()
+    
+    # Shutting the stages down in order, one sentinel per consumer.
+    for thread in reader_threads:
+        thread.join()
+    for _ in worker_threads:
+        decoded.put(None)
+    for thread in worker_threads:
+        thread.join()
+    finished.put(None)
+    writer_thread.join()
+    
+    return results, errors
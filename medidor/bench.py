@@ -0,0 +1,266 @@
+"""Benchmarks for the measurement pipeline and the regression gate against a baseline."""
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from .batch import list_images
+from .core import (REDUCED_DECODE_FLAGS, find_paper, find_paper_pyramid, load_image,
+                   measure_size, preprocess_image, reduced_decode_factor)
+from .profiling import StageProfiler
+from .tuning import AUTO_OBJECTS_EPS
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def benchmark_load_image(paths, scale=0.7, repeat=3):
+    rows = []
+    for path in paths:
+        row = {'path': path}
+        for reduced_decode in (False, True):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                img = load_image(path, scale=scale, reduced_decode=reduced_decode)
+            elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+            
+            # Size of the buffer the decoder hands back before the resize.
+            factor = reduced_decode_factor(scale) if reduced_decode else 1
+            decoded = cv2.imread(path, REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR))
+            
+            key = 'reduced' if reduced_decode else 'full'
+            row[key + '_ms'] = round(elapsed_ms, 1)
+            row[key + '_decoded_mb'] = round(decoded.nbytes / 2**20, 1)
+            row[key + '_shape'] = img.shape
+        rows.append(row)
+    return rows
+
+
+def compare_pyramid(paths, repeat=3, **kwargs):
+    rows = []
+    for path in paths:
+        img_original = load_image(path)
+        
+        start = time.perf_counter()
+        for _ in range(repeat):
+            img_preprocessed, _ = preprocess_image(img_original)
+            rect_coords = find_paper(img_preprocessed)
+        full_ms = (time.perf_counter() - start) / repeat * 1000
+        
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rect_coords_pyramid = find_paper_pyramid(img_original, **kwargs)
+        pyramid_ms = (time.perf_counter() - start) / repeat * 1000
+        
+        rows.append({'path'           : path,
+                     'full_ms'        : round(full_ms, 1),
+                     'pyramid_ms'     : round(pyramid_ms, 1),
+                     'corner_error_px': np.abs(rect_coords - rect_coords_pyramid).max()})
+    return rows
+
+
+def peak_memory_preprocess(paths, debug):
+    buffers = {}
+    peaks = []
+    for path in paths:
+        img_original = load_image(path)
+        tracemalloc.start()
+        img_preprocessed, img_each_step = preprocess_image(img_original, debug=debug, 
+                                                           buffers=buffers)
+        peaks.append(tracemalloc.get_traced_memory()[1])    #1
+        tracemalloc.stop()
+    return peaks
+
+
+def benchmark_warp(paths, scales=(1.0, 0.75, 0.5, 0.35), repeat=3):
+    kwargs = {'draw': False, 'objects_eps_param': AUTO_OBJECTS_EPS}
+    baseline = {path: measure_size(path, **kwargs)['sizes_mm'] for path in paths}
+    
+    for direct, scale in [(False, 1.0)] + [(True, scale) for scale in scales]:
+        profiler = StageProfiler(track_memory=False)
+        buffers = {}
+        errors_mm = []
+        for _ in range(repeat):
+            for path in paths:
+                sizes_mm = measure_size(path, buffers=buffers, profiler=profiler,
+                                        warp_direct=direct, warp_scale=scale, 
+                                        **kwargs)['sizes_mm']
+                if sizes_mm.shape == baseline[path].shape:
+                    errors_mm.extend(np.abs(sizes_mm - baseline[path]).ravel())    #1
+        
+        # Only the stages that run on the warped sheet.
+        warped_ms = sum(record['ms'] for record in profiler.records 
+                        if record['stage'] in WARPED_STAGES) / profiler.runs
+        print(f"{'direct' if direct else 'slice '} warp x{scale:<4}  "
+              f'{warped_ms:5.2f} ms/image   '
+              f'median error {np.median(errors_mm):5.2f} mm   '
+              f'max error {np.max(errors_mm):5.2f} mm')
+
+
+WARPED_STAGES = ('warp', 'preprocess_warped', 'contours_warped', 'sizes')
+
+
+def benchmark_subpix(paths, scales=(0.7, 0.5, 0.35, 0.25), reference_scale=1.0, repeat=3):
+    kwargs = {'draw': False, 'objects_eps_param': AUTO_OBJECTS_EPS}
+    reference = {path: measure_size(path, img_original_scale=reference_scale, 
+                                    subpix=True, **kwargs) 
+                 for path in paths}
+    
+    for scale in scales:
+        for subpix in (False, True):
+            buffers = {}
+            corner_errors = []
+            errors_mm = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for path in paths:
+                    try:
+                        result = measure_size(path, img_original_scale=scale, subpix=subpix,
+                                              buffers=buffers, **kwargs)
+                    except (IndexError, ValueError):
+                        continue
+                    # Paper corners in reference-resolution pixels.
+                    expected = reference[path]
+                    corners = result['paper_corners'] * reference_scale / scale
+                    corner_errors.append(np.abs(corners - expected['paper_corners']).mean())
+                    if result['sizes_mm'].shape == expected['sizes_mm'].shape:
+                        errors_mm.extend(np.abs(result['sizes_mm'] - expected['sizes_mm']).ravel())
+            elapsed_ms = (time.perf_counter() - start) / repeat / len(paths) * 1000
+            
+            print(f"scale {scale:<4} {'subpix' if subpix else 'pixel '}  "
+                  f'{elapsed_ms:6.2f} ms/image   '
+                  f'paper corner error {np.mean(corner_errors):4.2f} px   '
+                  f'median size error {np.median(errors_mm):4.2f} mm')
+
+
+def benchmark_paths():
+    return (list_images(os.path.join(PACKAGE_DIR, 'images'), '*.jpeg') + 
+            sorted(glob.glob(os.path.join(PACKAGE_DIR, os.pardir, 'IMG_2025*.jpg'))))
+
+
+def collect_metrics(paths, repeat=3, **measure_kwargs):
+    buffers = {}
+    
+    # Timing pass, memory tracking off.
+    profiler = StageProfiler(track_memory=False)
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            try:
+                measure_size(path, buffers=buffers, profiler=profiler, **measure_kwargs)
+            except (IndexError, ValueError):
+                errors += 1    #1
+    elapsed = time.perf_counter() - start
+    
+    metrics = {'throughput_ips': repeat * len(paths) / elapsed,
+               'errors'        : errors / repeat}
+    for row in profiler.summary():
+        metrics[row['stage'] + '.ms_p50'] = row['ms_p50']
+        metrics[row['stage'] + '.ms_p90'] = row['ms_p90']
+    
+    # Memory pass, once per image.
+    profiler = StageProfiler(track_memory=True)
+    for path in paths:
+        try:
+            measure_size(path, buffers=buffers, profiler=profiler, **measure_kwargs)
+        except (IndexError, ValueError):
+            pass
+    tracemalloc.stop()
+    for row in profiler.summary():
+        metrics[row['stage'] + '.bytes_max'] = row['bytes_max']    #2
+    return metrics
+
+
+# Differences below these are noise, whatever the relative change.
+MIN_DELTA = {'ms': 0.5, 'bytes': 2**20}
+
+
+def is_regression(name, value, baseline_value, threshold):
+    if name == 'errors':
+        return value > baseline_value
+    if name == 'throughput_ips':
+        return value < baseline_value * (1 - threshold)
+    min_delta = MIN_DELTA['bytes' if name.endswith('bytes_max') else 'ms']
+    return (value > baseline_value * (1 + threshold) and 
+            value - baseline_value > min_delta)    #3
+
+
+def run_benchmark(baseline_path, paths=None, threshold=0.25, update=False, 
+                  repeat=3, **measure_kwargs):
+    metrics = collect_metrics(paths or benchmark_paths(), repeat=repeat, 
+                              **measure_kwargs)
+    
+    if update or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump({'machine': platform.platform(), 
+                       'processor': platform.processor(),
+                       'metrics': metrics}, f, indent=2)
+        return metrics, []
+    
+    with open(baseline_path) as f:
+        baseline = json.load(f)['metrics']
+    regressions = [(name, baseline[name], value) for name, value in metrics.items()
+                   if name in baseline and is_regression(name, value, baseline[name], threshold)]
+    if regressions:
+        lines = [f'{name}: {old:.3g} -> {new:.3g}' for name, old, new in regressions]
+        raise AssertionError(f'performance regression over {threshold:.0%}:\n' + '\n'.join(lines))
+    return metrics, regressions
+
+
+def measure_import_time(statement='import medidor', repeat=5):
+    # Fresh interpreter per run, otherwise the modules are already cached.
+    times = []
+    for _ in range(repeat):
+        code = f'import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)'
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             cwd=os.path.dirname(PACKAGE_DIR), check=True).stdout
+        times.append(float(out) * 1000)
+    return round(min(times), 1)
+
+
+def write_frame_files(paths, directory, scale=0.7):
+    # The same pixels load_image would produce, dumped raw and as .npy.
+    os.makedirs(directory, exist_ok=True)
+    frames = []
+    for path in paths:
+        img = load_image(path, scale=scale)
+        name = os.path.join(directory, os.path.splitext(os.path.basename(path))[0])
+        img.tofile(name + '.bgr')
+        np.save(name + '.npy', img)
+        frames.append((path, name + '.bgr', name + '.npy', img.shape[:2]))
+    return frames
+
+
+def benchmark_frame_input(paths, directory, scale=0.7, repeat=5):
+    kwargs = {'draw': False, 'objects_eps_param': AUTO_OBJECTS_EPS}
+    rows = []
+    for path, raw_path, npy_path, frame_shape in write_frame_files(paths, directory, scale):
+        row = {'path': path}
+        inputs = {'jpeg': (path, {'img_original_scale': scale}),
+                  'raw' : (raw_path, {'img_original_scale': 1, 'frame_shape': frame_shape}),
+                  'npy' : (npy_path, {'img_original_scale': 1})}
+        buffers = {}
+        sizes = {}
+        for name, (input_path, input_kwargs) in inputs.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                load_image(input_path, scale=input_kwargs['img_original_scale'],
+                           frame_shape=input_kwargs.get('frame_shape'))
+            row[name + '_load_ms'] = round((time.perf_counter() - start) / repeat * 1000, 2)
+            
+            start = time.perf_counter()
+            for _ in range(repeat):
+                sizes[name] = measure_size(input_path, buffers=buffers, 
+                                           **input_kwargs, **kwargs)['sizes_mm']
+            row[name + '_total_ms'] = round((time.perf_counter() - start) / repeat * 1000, 2)
+        row['same_sizes'] = all(np.array_equal(sizes['jpeg'], sizes[name]) 
+                                for name in ('raw', 'npy'))    #1
+        rows.append(row)
+    return rows
@@ -0,0 +1,128 @@
+"""On-disk result cache keyed by image content and measurement parameters."""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .core import load_image, measure_size, warp_image, write_size
+
+CACHE_KEY_PARAMS = {'img_original_scale': 0.7,
+                    'PAPER_W'           : 210,
+                    'PAPER_H'           : 297,
+                    'SCALE'             : 3,
+                    'canny_thresh_1'    : 57, 
+                    'canny_thresh_2'    : 232,
+                    'paper_eps_param'   : 0.04, 
+                    'objects_eps_param' : 0.05,
+                    'reduced_decode'    : False,
+                    'pyramid'           : False,
+                    'proxy_scale'       : 0.25,
+                    'warp_direct'       : False,
+                    'warp_scale'        : 1.0,
+                    'subpix'            : False,
+                    'subpix_win'        : 5,
+                    'subpix_budget'     : 4,
+                    'frame_shape'       : None,
+                    'frame_index'       : 0}
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes=64 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+    
+    def key(self, path, params):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                digest.update(chunk)    #1
+        
+        key_params = {name: params.get(name, default) 
+                      for name, default in CACHE_KEY_PARAMS.items()}
+        digest.update(json.dumps(key_params, sort_keys=True).encode())    #2
+        return digest.hexdigest()
+    
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+    
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path) as entry:
+                result = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry_path)    #3
+        except FileNotFoundError:
+            pass    # evicted by another process after it was read
+        self.hits += 1
+        return result
+    
+    def put(self, key, result):
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **result)
+        os.replace(tmp_path, entry_path)    #4
+        self.evict()
+    
+    def evict(self):
+        # Least recently used first, until the directory fits in max_bytes.
+        # Batch workers evict concurrently, so entries can vanish between listing and removal.
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits'    : self.hits, 
+                'misses'  : self.misses, 
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+def measure_size_cached(path, cache, draw=False, **kwargs):
+    key = cache.key(path, kwargs)
+    result = cache.get(key)
+    if result is None:
+        result = measure_size(path, draw=False, **kwargs)
+        cache.put(key, result)
+    
+    if not draw:
+        return result
+    
+    # Drawing from cached corners: no preprocessing or contour search.
+    img_original = load_image(path, scale=kwargs.get('img_original_scale', 0.7),
+                              reduced_decode=kwargs.get('reduced_decode', False),
+                              frame_shape=kwargs.get('frame_shape'),
+                              frame_index=kwargs.get('frame_index', 0))
+    paper_w = kwargs.get('PAPER_W', 210) * kwargs.get('SCALE', 3)
+    paper_h = kwargs.get('PAPER_H', 297) * kwargs.get('SCALE', 3)
+    paper_coords = np.float32([[0,0], 
+                               [paper_w,0], 
+                               [0,paper_h],
+                               [paper_w,paper_h]])
+    img_warped = warp_image(result['paper_corners'], paper_coords, img_original,
+                            direct=kwargs.get('warp_direct', False),
+                            scale=kwargs.get('warp_scale', 1.0))
+    return write_size(result['object_corners'], result['sizes_mm'], img_warped)
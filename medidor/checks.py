@@ -0,0 +1,210 @@
+"""Runnable end-to-end checks on synthetic inputs: python -m medidor.checks"""
+import glob
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .batch import measure_batch, measure_pipeline
+from .bench import write_frame_files
+from .cache import CACHE_KEY_PARAMS, ResultCache, measure_size_cached
+from .core import PaperNotFoundError, measure_size
+from .profiling import StageProfiler
+from .server import start_server, stop_server
+from .stream import measure_stream, stream_stats, write_synthetic_video
+from .tuning import CameraProfiles, camera_id, measure_size_auto
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+SAMPLE = os.path.join(IMAGES_DIR, '1.jpeg')
+NO_PAPER = os.path.join(IMAGES_DIR, 'IMG_2230.jpg')
+
+
+def check_stream_slow_drift(tmp):
+    # 0.5 px/frame at the pipeline scale: the drift has to add up to a re-detection.
+    path = os.path.join(tmp, 'slow.avi')
+    write_synthetic_video(path, SAMPLE, n_frames=30, shift_every=10**6, speed=0.5 / 0.7)
+    records = list(measure_stream(path, objects_eps_param=(0.04, 0.05, 0.07, 0.1)))
+    redetected = [record['frame'] for record in records if record['redetected']]
+    assert redetected[0] == 0 and len(redetected) >= 4, redetected
+    assert max(np.diff(redetected)) <= 6, redetected
+    for record in records:
+        assert 'error' not in record, record
+        assert record['sizes_mm'].shape == (1, 2), (record['frame'], record['sizes_mm'])
+
+
+def check_stream_bad_source(tmp):
+    # A source that does not open is an error, not an empty stream.
+    try:
+        list(measure_stream(os.path.join(tmp, 'missing.avi')))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('no error for a missing video')
+    assert stream_stats([]) == {'frames': 0, 'redetected': 0, 'errors': 0}
+
+
+def check_no_paper_is_an_error(tmp):
+    # Both detection paths, and the batch error list, for a photo without a sheet.
+    for pyramid in (False, True):
+        try:
+            measure_size(NO_PAPER, draw=False, pyramid=pyramid)
+        except PaperNotFoundError:
+            continue
+        raise AssertionError(f'pyramid={pyramid}: no error for a photo without paper')
+    results, errors = measure_batch([NO_PAPER, SAMPLE], max_workers=1)
+    assert list(results) == [SAMPLE], results
+    assert [error['error'] for error in errors] == ['PaperNotFoundError'], errors
+
+
+def check_auto_retunes_bad_profile(tmp):
+    # A stored profile that no longer finds the sheet is replaced, not trusted.
+    profiles = CameraProfiles(os.path.join(tmp, 'profiles.json'))
+    bad = {'canny_thresh_1': 400, 'canny_thresh_2': 600, 'paper_eps_param': 0.04}
+    profiles.put(camera_id(SAMPLE), bad)
+    result = measure_size_auto(SAMPLE, profiles, draw=False)
+    assert profiles.get(camera_id(SAMPLE)) != bad
+    expected = measure_size(SAMPLE, draw=False, **profiles.get(camera_id(SAMPLE)))
+    assert np.allclose(result['sizes_mm'], expected['sizes_mm'])
+    try:
+        measure_size_auto(NO_PAPER, profiles, draw=False)
+    except PaperNotFoundError:
+        return
+    raise AssertionError('no error for a photo without paper')
+
+
+def check_batch_profile_summary(tmp):
+    # Worker records merge into the caller's profiler, with or without memory tracking.
+    assert StageProfiler(track_memory=False).summary() == []
+    for track_memory in (True, False):
+        profiler = StageProfiler(track_memory=track_memory)
+        results, _ = measure_batch([SAMPLE, NO_PAPER], max_workers=2, profiler=profiler)
+        rows = {row['stage']: row for row in profiler.summary()}
+        assert rows['total']['count'] == 2 and rows['load']['count'] == 2, rows
+        assert ('bytes_max' in rows['total']) == track_memory, rows['total']
+    profiler.merge([{'run': 1, 'image': SAMPLE, 'stage': 'load', 'ms': 1.0, 'bytes': 10}])
+    assert 'bytes_max' not in profiler.summary()[0]
+
+
+def check_cache_key_covers_options(tmp):
+    # Every option that changes the numbers must miss a result cached without it.
+    cache = ResultCache(os.path.join(tmp, 'cache'))
+    base = measure_size_cached(SAMPLE, cache)
+    options = ({'warp_direct': True, 'warp_scale': 0.5}, {'pyramid': True, 'proxy_scale': 0.5},
+               {'subpix': True}, {'subpix': True, 'subpix_win': 3, 'subpix_budget': 64},
+               {'PAPER_W': 216, 'PAPER_H': 279}, {'SCALE': 2})
+    for option in options:
+        cached = measure_size_cached(SAMPLE, cache, **option)
+        expected = measure_size(SAMPLE, draw=False, **option)
+        assert np.allclose(cached['sizes_mm'], expected['sizes_mm']), (option, cached['sizes_mm'])
+        assert cache.key(SAMPLE, option) != cache.key(SAMPLE, {}), option
+    assert np.allclose(base['sizes_mm'], measure_size_cached(SAMPLE, cache)['sizes_mm'])
+    assert set(CACHE_KEY_PARAMS) >= {name for option in options for name in option}
+    # Drawn from the cached corners onto a sheet of the requested size.
+    img_result = measure_size_cached(SAMPLE, cache, draw=True, PAPER_W=216, PAPER_H=279)
+    img_expected, _ = measure_size(SAMPLE, return_sizes=True, PAPER_W=216, PAPER_H=279)
+    assert img_result.shape == img_expected.shape, (img_result.shape, img_expected.shape)
+
+
+def _fill_cache(job):
+    directory, max_bytes, worker = job
+    cache = ResultCache(directory, max_bytes=max_bytes)
+    result = {'sizes_mm': np.zeros((8, 2))}
+    for i in range(300):
+        cache.put(f'{worker}-{i}', result)
+
+
+def check_cache_evicts_concurrently(tmp):
+    # Workers sharing a small cache evict each other's entries; none of them may fail on it.
+    directory = os.path.join(tmp, 'shared')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_fill_cache, [(directory, 20000, worker) for worker in range(4)]))
+    assert sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory)) <= 20000
+    cache = ResultCache(os.path.join(tmp, 'small'), max_bytes=2000)
+    images = sorted(glob.glob(os.path.join(IMAGES_DIR, '*.jp*g')))
+    results, errors = measure_batch(images, max_workers=4, cache=cache)
+    assert [error['path'] for error in errors] == [NO_PAPER], errors
+    assert len(results) == len(images) - 1, results
+
+
+def check_pipeline_reads_frame_files(tmp):
+    # Raw and .npy frames in a directory are found by default and measured like the JPEG.
+    directory = os.path.join(tmp, 'frames')
+    (_, _, _, frame_shape), = write_frame_files([SAMPLE], directory)
+    expected = measure_size(SAMPLE, draw=False)['sizes_mm']
+    for measure in (measure_pipeline, measure_batch):
+        results, errors = measure(directory, img_original_scale=1, frame_shape=frame_shape)
+        assert not errors, errors
+        assert sorted(os.path.splitext(path)[1] for path in results) == ['.bgr', '.npy'], results
+        for sizes_mm in results.values():
+            assert np.allclose(sizes_mm, expected), (sizes_mm, expected)
+
+
+def _post(url, data):
+    request = urllib.request.Request(url, data=data, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def check_server_survives_dead_worker(tmp):
+    # A killed worker fails its batch with 503 at worst; the next request gets a fresh pool.
+    server, service = start_server(port=0, workers=1, request_timeout=20)
+    try:
+        host, port = server.server_address[:2]
+        url = f'http://{host}:{port}/measure'
+        with open(SAMPLE, 'rb') as f:
+            data = f.read()
+        status, record = _post(url, data)
+        assert status == 200 and len(record['sizes_mm']) == 1, (status, record)
+        replies = []
+        request = threading.Thread(target=lambda: replies.append(_post(url, data)))
+        request.start()
+        for pid in list(service.executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        request.join(timeout=30)
+        assert replies and replies[0][0] in (200, 503), replies
+        status, record = _post(url, data)
+        assert status == 200 and len(record['sizes_mm']) == 1, (status, record)
+        # A request that outlives the timeout is answered, not left hanging.
+        service.request_timeout = 1e-4
+        status, record = _post(url, data)
+        assert status == 503 and record['error'] == 'timeout', (status, record)
+    finally:
+        stop_server(server, service)
+
+
+CHECKS = [check_stream_slow_drift, check_stream_bad_source, check_no_paper_is_an_error,
+          check_auto_retunes_bad_profile, check_batch_profile_summary,
+          check_cache_key_covers_options, check_cache_evicts_concurrently,
+          check_pipeline_reads_frame_files, check_server_survives_dead_worker]
+
+
+def main(names=None):
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in CHECKS:
+            if names and check.__name__ not in names:
+                continue
+            try:
+                check(tmp)
+                print(f'ok    {check.__name__}')
+            except Exception:
+                failed += 1
+                print(f'FAIL  {check.__name__}')
+                traceback.print_exc()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
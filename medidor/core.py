@@ -0,0 +1,566 @@
+"""Object size measurement on an A4 sheet, the pipeline from the notebook."""
+import os
+from contextlib import nullcontext
+
+import cv2
+import numpy as np
+
+SCALE = 3
+PAPER_W = 210 * SCALE
+PAPER_H = 297 * SCALE
+
+# Uncompressed inputs that are memory-mapped instead of decoded.
+FRAME_EXTENSIONS = ('.npy', '.raw', '.bgr')
+
+REDUCED_DECODE_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2,
+                        4: cv2.IMREAD_REDUCED_COLOR_4,
+                        8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def reduced_decode_factor(scale):
+    # Largest JPEG DCT reduction that still keeps at least `scale` resolution.
+    for factor in (8, 4, 2):
+        if scale * factor <= 1:
+            return factor
+    return 1
+
+
+def is_frame_file(path):
+    return os.path.splitext(str(path))[1].lower() in FRAME_EXTENSIONS
+
+
+def map_frame(path, frame_shape=None, index=0):
+    # Read-only view of one BGR frame; pages are read on first touch, nothing is copied.
+    if str(path).lower().endswith('.npy'):
+        frames = np.load(path, mmap_mode='r')
+        frame = frames[index] if frames.ndim == 4 else frames
+    else:
+        if frame_shape is None:
+            raise ValueError('raw frames need frame_shape=(height, width)')
+        height, width = frame_shape
+        frame = np.memmap(path, dtype=np.uint8, mode='r', shape=(height, width, 3),
+                          offset=index * height * width * 3)    #1
+    if frame.dtype != np.uint8 or frame.ndim != 3 or frame.shape[2] != 3:
+        raise ValueError(f'expected a uint8 BGR frame, got {frame.dtype} {frame.shape}')
+    return frame
+
+
+def load_image(path, scale=0.7, reduced_decode=False, frame_shape=None, frame_index=0):
+    # Raw frames skip the decoder; at scale 1 the mapped view itself is returned.
+    if is_frame_file(path):
+        frame = map_frame(path, frame_shape=frame_shape, index=frame_index)
+        if scale == 1:
+            return frame
+        return cv2.resize(frame, (0,0), None, scale, scale)
+    
+    if not reduced_decode:
+        img = cv2.imread(path)
+        img_resized = cv2.resize(img, (0,0), None, scale, scale)
+        return img_resized
+    
+    factor = reduced_decode_factor(scale)
+    flag = REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR)
+    img = cv2.imread(path, flag)    #1
+    
+    residual = scale * factor
+    if residual == 1:
+        return img
+    img_resized = cv2.resize(img, (0,0), None, residual, residual)    #2
+    return img_resized
+
+
+def decode_image(data, scale=0.7, reduced_decode=False):
+    # Same as load_image, for encoded bytes that never touched the disk.
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    factor = reduced_decode_factor(scale) if reduced_decode else 1
+    img = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR))
+    if img is None:
+        raise ValueError('could not decode image data')
+    
+    residual = scale * factor
+    if residual == 1:
+        return img
+    return cv2.resize(img, (0,0), None, residual, residual)
+
+
+def show_image(img):
+    # Imported here so that headless workers never pay for matplotlib.
+    import matplotlib.pyplot as plt
+    
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    plt.figure(figsize=(6,8))
+    plt.xticks([])
+    plt.yticks([])
+    plt.imshow(img)
+    plt.show()
+
+
+def get_buffer(buffers, name, shape):
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.uint8)
+        buffers[name] = buffer
+    return buffer
+
+
+def preprocess_image(img, thresh_1=57, thresh_2=232, debug=False, buffers=None):
+    kernel = np.ones((3,3))    #4
+    
+    # Lean mode: two single-channel buffers are reused for every step. 
+    # The result lives in `buffers` and is overwritten by the next call.
+    if not debug:
+        if buffers is None:
+            buffers = {}
+        buf_a = get_buffer(buffers, 'a', img.shape[:2])
+        buf_b = get_buffer(buffers, 'b', img.shape[:2])
+        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=buf_a)            #1
+        cv2.GaussianBlur(buf_a, (5,5), 1, dst=buf_b)                #2
+        cv2.Canny(buf_b, thresh_1, thresh_2, edges=buf_a)           #3
+        cv2.dilate(buf_a, kernel, dst=buf_b, iterations=1)          #5
+        cv2.morphologyEx(buf_b, cv2.MORPH_CLOSE, kernel, 
+                         dst=buf_a, iterations=4)                   #6
+        return buf_a, None
+    
+    img_gray  = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)      #1
+    img_blur  = cv2.GaussianBlur(img_gray, (5,5), 1)       #2
+    img_canny = cv2.Canny(img_blur, thresh_1, thresh_2)    #3
+    
+    img_dilated = cv2.dilate(img_canny, kernel, iterations=1)    #5
+    img_closed = cv2.morphologyEx(img_dilated, cv2.MORPH_CLOSE, 
+                                  kernel, iterations=4)          #6
+    
+    img_preprocessed = img_closed.copy()
+    
+    img_each_step = {'img_dilated': img_dilated, 
+                     'img_canny'  : img_canny, 
+                     'img_blur'   : img_blur, 
+                     'img_gray'   : img_gray}
+    
+    return img_preprocessed, img_each_step
+
+
+def find_contours(img_preprocessed, img_original, epsilon_param=0.04, draw=True,
+                  min_area=100, min_side=5, min_solidity=0.5):
+    contours, hierarchy = cv2.findContours(image=img_preprocessed, 
+                                           mode=cv2.RETR_EXTERNAL, 
+                                           method=cv2.CHAIN_APPROX_NONE)  #1
+    
+    img_contour = None
+    if draw:
+        img_contour = img_original.copy()
+        cv2.drawContours(img_contour, contours, -1, (203,192,255), 6)  #2
+    
+    polygons = []
+    for contour in contours:
+        # Cheap prefilters for noise blobs, before approxPolyDP.
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+        _, _, w, h = cv2.boundingRect(contour)
+        if min(w, h) < min_side:
+            continue
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
+        if area < min_solidity * hull_area:
+            continue
+        
+        # Several epsilons are tried in order until one gives 4 vertices.
+        for eps in np.atleast_1d(epsilon_param):
+            epsilon = eps * cv2.arcLength(curve=contour, 
+                                          closed=True)  #3
+            polygon = cv2.approxPolyDP(curve=contour, 
+                                       epsilon=epsilon, closed=True)  #4
+            if len(polygon) == 4:
+                break
+
+        if len(polygon) == 4:
+            polygon = polygon.reshape(4, 2)  #5
+        else:
+            # Not a quadrilateral: use its minimum-area rectangle instead.
+            box = cv2.boxPoints(cv2.minAreaRect(contour))
+            polygon = np.int32(np.round(box))
+        polygons.append(polygon)
+        
+        if not draw:
+            continue
+        
+        for point in polygon:    
+            img_contour = cv2.circle(img=img_contour, center=point, 
+                                     radius=8, color=(0,240,0), 
+                                     thickness=-1)  #6
+    
+    return polygons, img_contour
+
+
+def reorder_coords(polygon):
+    rect_coords = np.zeros((4, 2))
+
+    add = polygon.sum(axis=1)
+    rect_coords[0] = polygon[np.argmin(add)]    # Top left
+    rect_coords[3] = polygon[np.argmax(add)]    # Bottom right
+
+    subtract = np.diff(polygon, axis=1)
+    rect_coords[1] = polygon[np.argmin(subtract)]    # Top right
+    rect_coords[2] = polygon[np.argmax(subtract)]    # Bottom left
+    
+    return rect_coords
+
+
+def reorder_coords_batch(polygons):
+    polygons = np.asarray(polygons).reshape(-1, 4, 2)
+    rows = np.arange(len(polygons))[:, None]
+    
+    add = polygons.sum(axis=2)
+    subtract = np.diff(polygons, axis=2)[..., 0]
+    order = np.stack([np.argmin(add, axis=1),          # Top left
+                      np.argmin(subtract, axis=1),     # Top right
+                      np.argmax(subtract, axis=1),     # Bottom left
+                      np.argmax(add, axis=1)], axis=1) # Bottom right
+    
+    return np.float32(polygons[rows, order])
+
+
+class PaperNotFoundError(ValueError):
+    pass
+
+
+def find_paper(img_preprocessed, epsilon_param=0.04, min_fraction=0.2):
+    # Largest convex quadrilateral covering at least `min_fraction` of the image.
+    # No minAreaRect fallback here: without a real sheet there is nothing to measure against.
+    contours, _ = cv2.findContours(img_preprocessed, cv2.RETR_EXTERNAL, 
+                                   cv2.CHAIN_APPROX_NONE)
+    min_area = min_fraction * img_preprocessed.shape[0] * img_preprocessed.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area:
+            break
+        for eps in np.atleast_1d(epsilon_param):
+            polygon = cv2.approxPolyDP(contour, eps * cv2.arcLength(contour, True), True)
+            if (len(polygon) == 4 and cv2.isContourConvex(polygon) and 
+                    cv2.contourArea(polygon) >= min_area):
+                return np.float32(reorder_coords(polygon.reshape(4, 2)))
+    raise PaperNotFoundError(f'no paper sheet: no convex quadrilateral over '
+                             f'{min_fraction:.0%} of the image')
+
+
+def warp_image(rect_coords, paper_coords, img_original, pad=5, matrix=None,
+               direct=False, scale=1.0, buffers=None):
+
+    if matrix is None:
+        matrix = cv2.getPerspectiveTransform(src=rect_coords, 
+                                             dst=paper_coords)   #1
+    
+    # Direct mode: the pad crop and an optional downscale are folded into 
+    # the matrix, so the warp lands straight in a reused, already-cropped buffer.
+    if direct:
+        warped_w = int(round((PAPER_W - 2*pad) * scale))
+        warped_h = int(round((PAPER_H - 2*pad) * scale))
+        crop = np.array([[scale, 0, -pad*scale], 
+                         [0, scale, -pad*scale], 
+                         [0, 0, 1]])
+        if buffers is None:
+            buffers = {}
+        img_warped = get_buffer(buffers, 'warped', 
+                                (warped_h, warped_w) + img_original.shape[2:])
+        cv2.warpPerspective(img_original, crop @ matrix, 
+                            (warped_w, warped_h), dst=img_warped)
+        return img_warped
+    
+    img_warped = cv2.warpPerspective(img_original, matrix,
+                                      (PAPER_W, PAPER_H))    #2
+
+    warped_h = img_warped.shape[0]
+    warped_w = img_warped.shape[1]
+    img_warped = img_warped[pad:warped_h-pad, pad:warped_w-pad]  #3
+
+    return img_warped
+
+
+def calculate_sizes(polygons_warped):
+    
+    rect_coords_list = []
+    for polygon in polygons_warped:
+        rect_coords = np.float32(reorder_coords(polygon))  #1
+        rect_coords_list.append(rect_coords)
+    
+    heights = []
+    widths  = []
+    for rect_coords in rect_coords_list:
+        height = cv2.norm(rect_coords[0], rect_coords[2], cv2.NORM_L2)  #2
+        width  = cv2.norm(rect_coords[0], rect_coords[1], cv2.NORM_L2)  #3
+        
+        heights.append(height)
+        widths.append(width)
+    
+    heights = np.array(heights).reshape(-1,1)
+    widths  = np.array(widths).reshape(-1,1)
+    
+    sizes = np.hstack((heights, widths))  #4
+        
+    return sizes, rect_coords_list
+
+
+def calculate_sizes_batch(polygons_warped):
+    rect_coords = reorder_coords_batch(polygons_warped)    #1
+    
+    corners = rect_coords.astype(np.float64)
+    heights = np.sqrt(((corners[:, 0] - corners[:, 2])**2).sum(axis=1))    #2
+    widths  = np.sqrt(((corners[:, 0] - corners[:, 1])**2).sum(axis=1))    #3
+    
+    sizes = np.stack((heights, widths), axis=1)    #4
+    
+    return sizes, rect_coords
+
+
+def convert_to_mm(sizes_pixel, img_warped):
+    warped_h = img_warped.shape[0]
+    warped_w = img_warped.shape[1]
+    
+    scale_h = PAPER_H / warped_h    #1
+    scale_w = PAPER_W / warped_w    #2
+    
+    sizes_mm = []
+    
+    for size_pixel_h, size_pixel_w in sizes_pixel:
+        size_mm_h = size_pixel_h * scale_h / SCALE    #3
+        size_mm_w = size_pixel_w * scale_w / SCALE    #4
+        
+        sizes_mm.append([size_mm_h, size_mm_w])
+    
+    return np.array(sizes_mm)
+
+
+def convert_to_mm_batch(sizes_pixel, img_warped):
+    scale_h = PAPER_H / img_warped.shape[0]
+    scale_w = PAPER_W / img_warped.shape[1]
+    
+    return np.asarray(sizes_pixel).reshape(-1, 2) * (scale_h, scale_w) / SCALE
+
+
+def write_size(rect_coords_list, sizes, img_warped):
+    
+    img_result = img_warped.copy()
+    
+    for rect_coord, size in zip(rect_coords_list, sizes):
+        
+        top_left = rect_coord[0].astype(int)
+        top_right = rect_coord[1].astype(int)
+        bottom_left = rect_coord[2].astype(int)
+        
+        cv2.line(img_result, top_left, top_right, (255,100,50), 4)
+        cv2.line(img_result, top_left, bottom_left, (100,50,255), 4)
+        
+        cv2.putText(img_result, f'{np.int32(size[0])} mm', 
+                    (bottom_left[0]-20, bottom_left[1]+50), 
+                    cv2.FONT_HERSHEY_DUPLEX, 1, (100,50,255), 1)
+
+        cv2.putText(img_result, f'{np.int32(size[1])} mm', 
+                    (top_right[0]+20, top_right[1]+20), 
+                    cv2.FONT_HERSHEY_DUPLEX, 1, (255,100,50), 1)
+    
+    return img_result
+
+
+def find_paper_pyramid(img_original, proxy_scale=0.25, epsilon_param=0.04,
+                       thresh_1=57, thresh_2=232, refine_radius=24):
+    # Coarse: detect the paper quadrilateral on a small proxy image.
+    img_proxy = cv2.resize(img_original, (0,0), None, proxy_scale, proxy_scale,
+                           interpolation=cv2.INTER_AREA)    #1
+    img_proxy_preprocessed, _ = preprocess_image(img_proxy, thresh_1, thresh_2)
+    rect_coords = find_paper(img_proxy_preprocessed, epsilon_param) / proxy_scale    #2
+    
+    # Fine: look again at full resolution, only in a window around each corner.
+    img_h, img_w = img_original.shape[:2]
+    refined = np.zeros((4, 2))
+    for i, (x, y) in enumerate(rect_coords):
+        x0 = int(max(x - refine_radius, 0))
+        y0 = int(max(y - refine_radius, 0))
+        x1 = int(min(x + refine_radius, img_w))
+        y1 = int(min(y + refine_radius, img_h))
+        if x1 - x0 < 3 or y1 - y0 < 3:
+            refined[i] = (x, y)    # coarse corner off the frame: nothing to refine
+            continue
+        window = img_original[y0:y1, x0:x1]
+        
+        window_preprocessed, _ = preprocess_image(window, thresh_1, thresh_2)    #3
+        contours, _ = cv2.findContours(window_preprocessed, cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_NONE)
+        if not contours:
+            refined[i] = (x, y)
+            continue
+        
+        # Edge blob closest to the coarse corner.
+        center = (float(x - x0), float(y - y0))
+        contour = max(contours, key=lambda c: cv2.pointPolygonTest(c, center, True))    #4
+        points = contour.reshape(-1, 2)
+        
+        # Same extreme-point rule as reorder_coords: TL, TR, BL, BR.
+        add = points.sum(axis=1)
+        subtract = np.diff(points, axis=1).ravel()
+        pick = [np.argmin(add), np.argmin(subtract), 
+                np.argmax(subtract), np.argmax(add)][i]
+        refined[i] = points[pick] + (x0, y0)    #5
+    
+    return refined
+
+
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 0.05)
+
+
+def refine_corners(img, corners, win=5, max_shift=None, criteria=SUBPIX_CRITERIA):
+    # cornerSubPix on a small gray crop around each corner only.
+    corners = np.float32(corners).reshape(-1, 2)
+    if max_shift is None:
+        max_shift = win
+    img_h, img_w = img.shape[:2]
+    margin = win + 2
+    
+    refined = corners.copy()
+    for i, (x, y) in enumerate(corners):
+        x0 = int(round(x)) - margin
+        y0 = int(round(y)) - margin
+        x1 = x0 + 2*margin + 1
+        y1 = y0 + 2*margin + 1
+        if x0 < 0 or y0 < 0 or x1 > img_w or y1 > img_h:
+            continue    # too close to the border for a full window
+        
+        window = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)    #1
+        point = np.float32([[[x - x0, y - y0]]])
+        cv2.cornerSubPix(window, point, (win, win), (-1, -1), criteria)    #2
+        
+        shifted = point.reshape(2) + (x0, y0)
+        if np.abs(shifted - corners[i]).max() <= max_shift:    #3
+            refined[i] = shifted
+    return refined
+
+
+def refine_rect_coords(img, rect_coords_list, win=5, budget=64):
+    # At most `budget` corners get refined, largest objects first.
+    rect_coords_list = np.float32(rect_coords_list).reshape(-1, 4, 2)
+    if len(rect_coords_list) == 0:
+        return rect_coords_list
+    areas = [cv2.contourArea(coords[[0, 1, 3, 2]]) for coords in rect_coords_list]
+    
+    refined = rect_coords_list.copy()
+    for index in np.argsort(areas)[::-1][:budget // 4]:
+        refined[index] = refine_corners(img, rect_coords_list[index], win=win)
+    return refined
+
+
+def detect_paper(img_original, paper_eps_param=0.04, canny_thresh_1=57, 
+                 canny_thresh_2=232, pyramid=False, proxy_scale=0.25, buffers=None):
+    if pyramid:
+        return np.float32(find_paper_pyramid(img_original, 
+                                             proxy_scale=proxy_scale,
+                                             epsilon_param=paper_eps_param,
+                                             thresh_1=canny_thresh_1,
+                                             thresh_2=canny_thresh_2))
+    
+    img_preprocessed, _ = preprocess_image(img_original, 
+                                           thresh_1=canny_thresh_1, 
+                                           thresh_2=canny_thresh_2,
+                                           buffers=buffers)
+    return find_paper(img_preprocessed, paper_eps_param)
+
+
+NO_STAGE = nullcontext()
+
+
+def measure_size(path, img_original_scale=0.7,
+                 PAPER_W=210, PAPER_H=297, SCALE=3, 
+                 paper_eps_param=0.04, objects_eps_param=0.05,  
+                 canny_thresh_1=57, canny_thresh_2=232,
+                 return_sizes=False, draw=True, reduced_decode=False,
+                 pyramid=False, proxy_scale=0.25, buffers=None, profiler=None,
+                 img_original=None, warp_direct=False, warp_scale=1.0,
+                 subpix=False, subpix_win=5, subpix_budget=4,
+                 frame_shape=None, frame_index=0):
+    
+    PAPER_W = PAPER_W * SCALE
+    PAPER_H = PAPER_H * SCALE
+    
+    # Preprocessing buffers, reused across calls when the caller keeps them.
+    if buffers is None:
+        buffers = {}
+    
+    # Per-stage timing, only when a profiler is passed in.
+    if profiler is not None:
+        profiler.start_run(path)
+        stage = profiler.stage
+    else:
+        stage = lambda name: NO_STAGE
+    
+    # Loading original image, unless the caller already decoded it.
+    if img_original is None:
+        with stage('load'):
+            img_original = load_image(path=path, scale=img_original_scale, 
+                                      reduced_decode=reduced_decode,
+                                      frame_shape=frame_shape, frame_index=frame_index)
+    
+    # Finding paper corners on a small proxy, then refining at full size.
+    if pyramid:
+        with stage('paper_pyramid'):
+            rect_coords = np.float32(find_paper_pyramid(img_original, 
+                                                        proxy_scale=proxy_scale,
+                                                        epsilon_param=paper_eps_param,
+                                                        thresh_1=canny_thresh_1,
+                                                        thresh_2=canny_thresh_2))
+    else:
+        with stage('preprocess'):
+            img_preprocessed, img_each_step = preprocess_image(img_original, 
+                                                               thresh_1=canny_thresh_1, 
+                                                               thresh_2=canny_thresh_2,
+                                                               buffers=buffers.setdefault('paper', {}))
+    
+        # Finding the paper sheet and its ordered corners.
+        with stage('contours'):
+            rect_coords = find_paper(img_preprocessed, epsilon_param=paper_eps_param)
+
+    # Optional sub-pixel refinement of the paper corners.
+    if subpix:
+        with stage('subpix'):
+            rect_coords = refine_corners(img_original, rect_coords, win=subpix_win)
+
+    # Warping image according to paper contours.
+    with stage('warp'):
+        paper_coords = np.float32([[0,0], 
+                                   [PAPER_W,0], 
+                                   [0,PAPER_H],
+                                   [PAPER_W,PAPER_H]])
+        img_warped = warp_image(rect_coords, paper_coords, img_original,
+                                direct=warp_direct, scale=warp_scale,
+                                buffers=buffers.setdefault('warp', {}))
+    
+    # Preprocessing the warped image.
+    with stage('preprocess_warped'):
+        img_warped_preprocessed, _ = preprocess_image(img_warped, 
+                                                      buffers=buffers.setdefault('objects', {}))
+    
+    # Finding contour in the warped image.
+    with stage('contours_warped'):
+        polygons_warped, img_contours_warped = find_contours(img_warped_preprocessed, 
+                                                             img_warped,
+                                                             epsilon_param=objects_eps_param,
+                                                             draw=draw)
+    
+    # Edge langth calculation.
+    with stage('sizes'):
+        sizes, rect_coords_list = calculate_sizes_batch(polygons_warped)
+        if subpix and subpix_budget > 4:
+            rect_coords_list = refine_rect_coords(img_warped, rect_coords_list, 
+                                                  win=subpix_win, budget=subpix_budget - 4)
+            sizes, rect_coords_list = calculate_sizes_batch(rect_coords_list)
+        sizes_mm = convert_to_mm_batch(sizes, img_warped)
+    
+    # Headless mode: numbers only, nothing is drawn.
+    if not draw:
+        return {'paper_corners' : rect_coords,
+                'object_corners': rect_coords_list,
+                'sizes_px'      : sizes,
+                'sizes_mm'      : sizes_mm}
+    
+    with stage('draw'):
+        img_result = write_size(rect_coords_list, sizes_mm, img_warped)
+    
+    if return_sizes:
+        return img_result, sizes_mm
+    
+    return img_result
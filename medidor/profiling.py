@@ -0,0 +1,88 @@
+"""Opt-in per-stage timing and allocation profiling for measure_size."""
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageProfiler:
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.records = []
+        self.runs = 0
+        self.image = None
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()    #1
+    
+    def start_run(self, image):
+        self.runs += 1
+        self.image = image
+    
+    def merge(self, records):
+        # Records from another profiler, e.g. a batch worker, with fresh run ids.
+        run_ids = {}
+        for record in records:
+            if record['run'] not in run_ids:
+                self.runs += 1
+                run_ids[record['run']] = self.runs
+            self.records.append(dict(record, run=run_ids[record['run']]))
+    
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'run'  : self.runs, 
+                      'image': self.image,
+                      'stage': name, 
+                      'ms'   : (time.perf_counter() - start) * 1000}
+            if self.track_memory:
+                record['bytes'] = tracemalloc.get_traced_memory()[1] - mem_start    #2
+            self.records.append(record)
+    
+    def summary(self, percentiles=(50, 90, 99)):
+        if not self.records:
+            return []
+        # Merged records only carry bytes if every profiler that made them tracked memory.
+        track_memory = all('bytes' in record for record in self.records)
+        stages = {}
+        totals = {}
+        for record in self.records:
+            stages.setdefault(record['stage'], []).append(record)
+            total = totals.setdefault(record['run'], {'ms': 0, 'bytes': 0})
+            total['ms'] += record['ms']
+            total['bytes'] = max(total['bytes'], record.get('bytes', 0))
+        stages['total'] = list(totals.values())    #3
+        
+        rows = []
+        for name, records in stages.items():
+            ms = np.array([record['ms'] for record in records])
+            row = {'stage': name, 'count': len(ms), 'ms_mean': float(ms.mean())}
+            for p in percentiles:
+                row[f'ms_p{p}'] = float(np.percentile(ms, p))
+            if track_memory:
+                allocated = np.array([record['bytes'] for record in records])
+                row['bytes_max'] = int(allocated.max())
+                for p in percentiles:
+                    row[f'bytes_p{p}'] = float(np.percentile(allocated, p))
+            rows.append(row)
+        return rows
+    
+    def to_json(self, path, percentiles=(50, 90, 99)):
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(percentiles), 
+                       'records': self.records}, f, indent=2)
+    
+    def to_csv(self, path, percentiles=(50, 90, 99)):
+        rows = self.summary(percentiles)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['stage'])
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,263 @@
+"""Local HTTP measurement service: warm worker processes and micro-batched requests."""
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from .core import decode_image, measure_size, preprocess_image
+
+# Query parameters a client may set, with the type they are parsed to.
+REQUEST_PARAMS = {'scale'         : float,
+                  'paper_eps'     : float,
+                  'objects_eps'   : float,
+                  'reduced_decode': lambda value: value.lower() in ('1', 'true', 'yes'),
+                  'pyramid'       : lambda value: value.lower() in ('1', 'true', 'yes')}
+
+# Error name of records failed by the service rather than by the image; replied as 503.
+UNAVAILABLE = 'ServiceUnavailable'
+
+_worker_buffers = {}
+
+
+def _warm_worker():
+    # Runs once per process: pays the OpenCV start-up before the first request.
+    preprocess_image(np.zeros((64, 64, 3), np.uint8), buffers=_worker_buffers)
+
+
+def _measure_request_batch(batch):
+    records = []
+    for data, params in batch:
+        try:
+            scale = params.get('scale', 0.7)
+            img = decode_image(data, scale=scale,
+                               reduced_decode=params.get('reduced_decode', False))
+            result = measure_size(None, img_original=img, draw=False,
+                                  img_original_scale=scale,
+                                  paper_eps_param=params.get('paper_eps', 0.04),
+                                  objects_eps_param=params.get('objects_eps', 0.05),
+                                  pyramid=params.get('pyramid', False),
+                                  buffers=_worker_buffers)
+            records.append({'paper_corners': result['paper_corners'].tolist(),
+                            'sizes_mm'     : result['sizes_mm'].round(1).tolist()})
+        except Exception as e:    #1
+            records.append({'error': type(e).__name__, 'message': str(e)})
+    return records
+
+
+class MeasureService:
+    def __init__(self, workers=2, max_batch=8, max_wait_ms=5, history=1000, request_timeout=30):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.request_timeout = request_timeout
+        self.pending = queue.Queue()
+        self.in_flight = threading.BoundedSemaphore(workers)    #2
+        self.latencies = deque(maxlen=history)
+        self.queue_waits = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.requests = 0
+        self.errors = 0
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.batcher = None
+    
+    def start(self):
+        self.executor = self._new_pool()
+        # Starting every worker now rather than on the first request.
+        for future in [self.executor.submit(_warm_worker) for _ in range(self.workers)]:
+            future.result()
+        self.batcher = threading.Thread(target=self._run_batcher, daemon=True)
+        self.batcher.start()
+        return self
+    
+    def stop(self):
+        self.pending.put(None)
+        self.batcher.join()
+        self.executor.shutdown()
+    
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+    
+    def _replace_pool(self, broken):
+        # A worker that died takes the whole pool down; later batches go to a fresh one.
+        with self.lock:
+            if self.executor is not broken:
+                return
+            self.executor = self._new_pool()
+            self.restarts += 1
+        broken.shutdown(wait=False)
+    
+    def submit(self, data, params=None):
+        future = Future()
+        self.pending.put((data, params or {}, future, time.perf_counter()))
+        return future
+    
+    def measure(self, data, params=None, timeout=None):
+        # Raises TimeoutError when no record arrives in time, the request stays queued.
+        start = time.perf_counter()
+        future = self.submit(data, params)
+        try:
+            record = future.result(timeout=timeout)
+        except TimeoutError:
+            with self.lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        with self.lock:
+            self.requests += 1
+            self.errors += 'error' in record
+            self.latencies.append((time.perf_counter() - start) * 1000)
+        return record
+    
+    def _run_batcher(self):
+        while True:
+            # A batch goes out only when a worker is free, so requests queue up meanwhile.
+            self.in_flight.acquire()
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.put(None)    #3
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+    
+    def _dispatch(self, batch):
+        now = time.perf_counter()
+        with self.lock:
+            self.batch_sizes.append(len(batch))
+            self.queue_waits.extend((now - enqueued) * 1000 for *_, enqueued in batch)
+        requests = [(data, params) for data, params, _, _ in batch]
+        executor = self.executor
+        try:
+            job = executor.submit(_measure_request_batch, requests)
+        except BrokenProcessPool:
+            self._replace_pool(executor)
+            try:
+                job = self.executor.submit(_measure_request_batch, requests)
+            except Exception as e:
+                self.in_flight.release()
+                self._fail(batch, e)
+                return
+        
+        def done(job):
+            self.in_flight.release()
+            try:
+                records = job.result()
+            except BrokenProcessPool as e:
+                self._replace_pool(executor)
+                self._fail(batch, e)
+                return
+            except Exception as e:
+                records = [{'error': type(e).__name__, 'message': str(e)}] * len(batch)
+            for (_, _, future, _), record in zip(batch, records):
+                future.set_result(record)
+        job.add_done_callback(done)
+    
+    def _fail(self, batch, e):
+        for _, _, future, _ in batch:
+            future.set_result({'error': UNAVAILABLE, 'message': f'{type(e).__name__}: {e}'})
+    
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            queue_waits = np.array(self.queue_waits)
+            batch_sizes = np.array(self.batch_sizes)
+            metrics = {'requests'   : self.requests,
+                       'errors'     : self.errors,
+                       'queue_depth': self.pending.qsize(),
+                       'workers'    : self.workers,
+                       'restarts'   : self.restarts}
+        if len(latencies):
+            metrics.update({'latency_ms_p50'   : float(np.percentile(latencies, 50)),
+                            'latency_ms_p95'   : float(np.percentile(latencies, 95)),
+                            'latency_ms_p99'   : float(np.percentile(latencies, 99)),
+                            'queue_wait_ms_p50': float(np.percentile(queue_waits, 50)),
+                            'batch_size_mean'  : float(batch_sizes.mean())})
+        return metrics
+
+
+class MeasureHandler(BaseHTTPRequestHandler):
+    # POST /measure with the encoded image as body, GET /metrics, GET /health.
+    service = None
+    
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._reply(200, self.service.metrics())
+        elif path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'not found'})
+    
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/measure':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            params = {name: REQUEST_PARAMS[name](values[-1])
+                      for name, values in parse_qs(url.query).items()
+                      if name in REQUEST_PARAMS}
+        except ValueError as e:
+            self._reply(400, {'error': 'bad parameter', 'message': str(e)})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            self._reply(400, {'error': 'empty body'})
+            return
+        try:
+            record = self.service.measure(self.rfile.read(length), params,
+                                          timeout=self.service.request_timeout)
+        except TimeoutError:
+            self._reply(503, {'error': 'timeout',
+                              'message': f'no result in {self.service.request_timeout} s'})
+            return
+        if record.get('error') == UNAVAILABLE:
+            self._reply(503, record)
+        else:
+            self._reply(422 if 'error' in record else 200, record)
+    
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass    # the metrics endpoint replaces the access log
+
+
+def start_server(host='127.0.0.1', port=8080, workers=2, max_batch=8, max_wait_ms=5,
+                 request_timeout=30):
+    # Port 0 picks a free port, see server.server_address.
+    service = MeasureService(workers=workers, max_batch=max_batch, max_wait_ms=max_wait_ms,
+                             request_timeout=request_timeout).start()
+    handler = type('Handler', (MeasureHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, service
+
+
+def stop_server(server, service):
+    server.shutdown()
+    server.server_close()
+    service.stop()
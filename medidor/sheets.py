@@ -0,0 +1,71 @@
+"""Several paper sheets in one frame."""
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .core import (PAPER_H, PAPER_W, calculate_sizes_batch, convert_to_mm_batch,
+                   find_contours, load_image, preprocess_image, reorder_coords,
+                   warp_image)
+
+
+def find_papers(img_preprocessed, epsilon_param=0.04, min_fraction=0.05, 
+                aspect_range=(1.15, 1.75)):
+    contours, _ = cv2.findContours(img_preprocessed, cv2.RETR_EXTERNAL, 
+                                   cv2.CHAIN_APPROX_NONE)
+    img_area = img_preprocessed.shape[0] * img_preprocessed.shape[1]
+    
+    papers = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_fraction * img_area:    #1
+            continue
+        epsilon = epsilon_param * cv2.arcLength(contour, True)
+        polygon = cv2.approxPolyDP(contour, epsilon, True)
+        if len(polygon) != 4 or not cv2.isContourConvex(polygon):
+            continue
+        
+        # A4 is 1:1.41, perspective moves it a bit either way.
+        rect_coords = np.float32(reorder_coords(polygon.reshape(4, 2)))
+        height = np.linalg.norm(rect_coords[2] - rect_coords[0])
+        width  = np.linalg.norm(rect_coords[1] - rect_coords[0])
+        aspect = max(height, width) / max(min(height, width), 1)
+        if aspect_range[0] <= aspect <= aspect_range[1]:    #2
+            papers.append(rect_coords)
+    
+    # Left to right, then top to bottom.
+    papers.sort(key=lambda coords: (coords[:, 0].mean(), coords[:, 1].mean()))
+    return papers
+
+
+def measure_sheet(img_original, rect_coords, objects_eps_param=0.05, buffers=None):
+    if buffers is None:
+        buffers = {}
+    paper_coords = np.float32([[0,0], 
+                               [PAPER_W,0], 
+                               [0,PAPER_H],
+                               [PAPER_W,PAPER_H]])
+    img_warped = warp_image(rect_coords, paper_coords, img_original)
+    img_warped_preprocessed, _ = preprocess_image(img_warped, buffers=buffers)
+    polygons_warped, _ = find_contours(img_warped_preprocessed, img_warped,
+                                       epsilon_param=objects_eps_param, draw=False)
+    sizes, rect_coords_list = calculate_sizes_batch(polygons_warped)
+    return {'paper_corners' : rect_coords,
+            'object_corners': rect_coords_list,
+            'sizes_px'      : sizes,
+            'sizes_mm'      : convert_to_mm_batch(sizes, img_warped)}
+
+
+def measure_sheets(path, img_original_scale=0.7, paper_eps_param=0.04, 
+                   objects_eps_param=0.05, canny_thresh_1=57, canny_thresh_2=232,
+                   max_workers=None, img_original=None):
+    if img_original is None:
+        img_original = load_image(path, scale=img_original_scale)
+    img_preprocessed, _ = preprocess_image(img_original, 
+                                           thresh_1=canny_thresh_1, 
+                                           thresh_2=canny_thresh_2)
+    papers = find_papers(img_preprocessed, epsilon_param=paper_eps_param)
+    
+    # One thread per sheet: OpenCV releases the GIL while it works.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda rect_coords: measure_sheet(
+            img_original, rect_coords, objects_eps_param), papers))    #3
@@ -0,0 +1,116 @@
+"""SQLite store for measurement results, queryable by time and size without re-running OpenCV."""
+import hashlib
+import json
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS measurements (
+    id            INTEGER PRIMARY KEY,
+    image_hash    TEXT NOT NULL,
+    path          TEXT,
+    job           TEXT,
+    measured_at   REAL NOT NULL,
+    paper_corners TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    measurement_id INTEGER NOT NULL REFERENCES measurements(id),
+    idx            INTEGER NOT NULL,
+    height_mm      REAL NOT NULL,
+    width_mm       REAL NOT NULL,
+    PRIMARY KEY (measurement_id, idx)
+);
+CREATE INDEX IF NOT EXISTS measurements_time ON measurements (measured_at);
+CREATE INDEX IF NOT EXISTS measurements_hash ON measurements (image_hash);
+CREATE INDEX IF NOT EXISTS objects_width ON objects (width_mm);
+CREATE INDEX IF NOT EXISTS objects_height ON objects (height_mm);
+'''
+
+
+def image_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')    #1
+        self.connection.execute('PRAGMA analysis_limit=1000')
+        self.connection.executescript(SCHEMA)
+    
+    def close(self):
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def add_results(self, records, job=None):
+        # One transaction per job; records are dicts as returned by the batch workers.
+        objects = []
+        with self.connection:
+            for record in records:
+                cursor = self.connection.execute(
+                    'INSERT INTO measurements (image_hash, path, job, measured_at, paper_corners) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (record.get('image_hash') or image_hash(record['path']),
+                     record.get('path'), job, record.get('measured_at', time.time()),
+                     json.dumps(_as_list(record.get('paper_corners')))))
+                objects.extend((cursor.lastrowid, i, float(height_mm), float(width_mm))
+                               for i, (height_mm, width_mm) in enumerate(record['sizes_mm']))
+            self.connection.executemany(
+                'INSERT INTO objects (measurement_id, idx, height_mm, width_mm) '
+                'VALUES (?, ?, ?, ?)', objects)    #2
+        
+        # Sampled planner statistics, so time and size bounds pick the selective index.
+        self.connection.execute('ANALYZE')
+        return len(records)
+    
+    def query(self, since=None, until=None, min_width=None, max_width=None,
+              min_height=None, max_height=None, job=None):
+        # One row per object; every bound is optional and inclusive.
+        conditions = []
+        params = []
+        for column, op, value in (('m.measured_at', '>=', since),
+                                  ('m.measured_at', '<=', until),
+                                  ('o.width_mm', '>=', min_width),
+                                  ('o.width_mm', '<=', max_width),
+                                  ('o.height_mm', '>=', min_height),
+                                  ('o.height_mm', '<=', max_height),
+                                  ('m.job', '=', job)):
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                params.append(value)
+        sql = ('SELECT m.path, m.image_hash, m.job, m.measured_at, o.idx, o.height_mm, o.width_mm '
+               'FROM objects o JOIN measurements m ON m.id = o.measurement_id')
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # The unary + keeps the sort from dictating the time index over a narrower size one.
+        sql += ' ORDER BY +m.measured_at, o.idx'
+        columns = ('path', 'image_hash', 'job', 'measured_at', 'object', 'height_mm', 'width_mm')
+        return [dict(zip(columns, row)) for row in self.connection.execute(sql, params)]
+    
+    def latest(self, image_hash):
+        row = self.connection.execute(
+            'SELECT id, path, measured_at, paper_corners FROM measurements '
+            'WHERE image_hash = ? ORDER BY measured_at DESC LIMIT 1', (image_hash,)).fetchone()
+        if row is None:
+            return None
+        sizes_mm = self.connection.execute(
+            'SELECT height_mm, width_mm FROM objects WHERE measurement_id = ? ORDER BY idx',
+            (row[0],)).fetchall()
+        return {'path'         : row[1],
+                'measured_at'  : row[2],
+                'paper_corners': json.loads(row[3]),
+                'sizes_mm'     : [list(size) for size in sizes_mm]}
+
+
+def _as_list(value):
+    return value.tolist() if hasattr(value, 'tolist') else value
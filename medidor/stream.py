@@ -0,0 +1,108 @@
+"""Measurement from a video file or capture device."""
+import time
+
+import cv2
+import numpy as np
+
+from .core import (PAPER_H, PAPER_W, calculate_sizes_batch, convert_to_mm_batch,
+                   detect_paper, find_contours, preprocess_image, warp_image, write_size)
+
+
+def measure_stream(source, img_original_scale=0.7, paper_eps_param=0.04, 
+                   objects_eps_param=0.05, canny_thresh_1=57, canny_thresh_2=232,
+                   drift_thresh=2.0, pyramid=False, draw=False, max_frames=None):
+    capture = cv2.VideoCapture(source)    #1
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError(f'could not open video source {source!r}')
+    paper_coords = np.float32([[0,0], 
+                               [PAPER_W,0], 
+                               [0,PAPER_H],
+                               [PAPER_W,PAPER_H]])
+    buffers = {}
+    matrix = None
+    rect_coords = None    # corners the cached matrix was built from
+    tracked = None        # the same corners, followed frame to frame
+    gray_prev = None
+    index = 0
+    
+    try:
+        while max_frames is None or index < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            start = time.perf_counter()
+            record = {'frame': index, 'redetected': False}
+            
+            img_original = cv2.resize(frame, (0,0), None, 
+                                      img_original_scale, img_original_scale)
+            gray = cv2.cvtColor(img_original, cv2.COLOR_BGR2GRAY)
+            
+            # Tracking the four paper corners from the previous frame.
+            if matrix is not None:
+                tracked, status, _ = cv2.calcOpticalFlowPyrLK(
+                    gray_prev, gray, tracked.reshape(-1, 1, 2), None)    #2
+                tracked = tracked.reshape(4, 2)
+                # Drift is measured against the matrix corners, so slow motion adds up.
+                drift = np.abs(tracked - rect_coords).max()
+                if not status.all() or drift > drift_thresh:
+                    matrix = None
+            
+            try:
+                # Paper detection only when there is no valid matrix.
+                if matrix is None:
+                    rect_coords = detect_paper(img_original, paper_eps_param,
+                                               canny_thresh_1, canny_thresh_2,
+                                               pyramid=pyramid,
+                                               buffers=buffers.setdefault('paper', {}))
+                    matrix = cv2.getPerspectiveTransform(src=rect_coords, 
+                                                         dst=paper_coords)    #3
+                    tracked = rect_coords.copy()
+                    record['redetected'] = True
+                
+                img_warped = warp_image(rect_coords, paper_coords, img_original, 
+                                        matrix=matrix)
+                img_warped_preprocessed, _ = preprocess_image(
+                    img_warped, buffers=buffers.setdefault('objects', {}))
+                polygons_warped, _ = find_contours(img_warped_preprocessed, img_warped,
+                                                   epsilon_param=objects_eps_param, 
+                                                   draw=False)
+                sizes, rect_coords_list = calculate_sizes_batch(polygons_warped)
+                record['sizes_mm'] = convert_to_mm_batch(sizes, img_warped)
+                if draw:
+                    record['img_result'] = write_size(rect_coords_list, 
+                                                      record['sizes_mm'], img_warped)
+            except (IndexError, ValueError) as e:    #4
+                matrix = None
+                record['error'] = str(e)
+            
+            gray_prev = gray
+            record['latency_ms'] = (time.perf_counter() - start) * 1000
+            index += 1
+            yield record
+    finally:
+        capture.release()
+
+
+def stream_stats(records):
+    latencies = np.array([record['latency_ms'] for record in records])
+    stats = {'frames'    : len(latencies),
+             'redetected': sum(record['redetected'] for record in records),
+             'errors'    : sum('error' in record for record in records)}
+    if len(latencies):
+        stats.update({'latency_p50': np.percentile(latencies, 50),
+                      'latency_p95': np.percentile(latencies, 95),
+                      'fps'        : 1000 / latencies.mean()})
+    return stats
+
+
+def write_synthetic_video(path, img_path, n_frames=60, fps=30, shift_every=20, speed=0.0):
+    img = cv2.imread(img_path)
+    img_h, img_w = img.shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (img_w, img_h))
+    for i in range(n_frames):
+        # The sheet jumps a few pixels every `shift_every` frames, and drifts by `speed` px/frame.
+        shift = np.float32([[1, 0, 3 * (i // shift_every) + speed * i], [0, 1, 0]])
+        writer.write(cv2.warpAffine(img, shift, (img_w, img_h), 
+                                    borderMode=cv2.BORDER_REPLICATE))
+    writer.release()
@@ -0,0 +1,109 @@
+"""Automatic Canny/epsilon tuning with per-camera profiles."""
+import json
+import os
+import struct
+
+import cv2
+
+from .core import PaperNotFoundError, find_paper, load_image, measure_size, preprocess_image
+
+AUTO_THRESHOLDS = [(57, 232), (50, 200), (30, 150), (80, 250), (20, 100), (100, 300)]
+AUTO_PAPER_EPS = [0.04, 0.02, 0.06]
+AUTO_OBJECTS_EPS = (0.04, 0.05, 0.07, 0.1)
+
+
+def camera_id(path):
+    with open(path, 'rb') as f:
+        data = f.read(2**17)    # EXIF and the frame header sit at the start
+    
+    # EXIF Make and Model tags from IFD0.
+    names = []
+    start = data.find(b'Exif\x00\x00')
+    if start >= 0:
+        tiff = data[start + 6:]
+        endian = '<' if tiff[:2] == b'II' else '>'
+        try:
+            ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+            count = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+            for i in range(count):
+                entry = tiff[ifd + 2 + 12*i : ifd + 14 + 12*i]
+                tag, kind, n, offset = struct.unpack(endian + 'HHII', entry)
+                if tag in (0x010F, 0x0110) and kind == 2:    #1
+                    raw = entry[8:8 + n] if n <= 4 else tiff[offset:offset + n]
+                    names.append(raw.rstrip(b'\x00').decode(errors='ignore').strip())
+        except struct.error:
+            names = []
+    if names:
+        return ' '.join(names)
+    
+    # No EXIF: fall back to the JPEG frame size.
+    i = 2
+    while i + 9 < len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in (0xC0, 0xC1, 0xC2):
+            h, w = struct.unpack('>HH', data[i + 5:i + 9])    #2
+            return f'unknown-{w}x{h}'
+        i += 2 + length
+    return 'unknown'
+
+
+def paper_quad_ok(img_preprocessed, epsilon_param, min_fraction=0.2):
+    # Same rule measure_size uses, so a tuned profile really finds the sheet.
+    try:
+        find_paper(img_preprocessed, epsilon_param, min_fraction)
+    except PaperNotFoundError:
+        return False
+    return True
+
+
+def tune_profile(img_original, proxy_scale=0.25):
+    img_proxy = cv2.resize(img_original, (0,0), None, proxy_scale, proxy_scale,
+                           interpolation=cv2.INTER_AREA)
+    buffers = {}
+    for thresh_1, thresh_2 in AUTO_THRESHOLDS:
+        img_proxy_preprocessed, _ = preprocess_image(img_proxy, thresh_1, thresh_2, 
+                                                     buffers=buffers)
+        for eps in AUTO_PAPER_EPS:
+            if paper_quad_ok(img_proxy_preprocessed, eps):
+                return {'canny_thresh_1'   : thresh_1, 
+                        'canny_thresh_2'   : thresh_2,
+                        'paper_eps_param'  : eps,
+                        'objects_eps_param': AUTO_OBJECTS_EPS}
+    return None
+
+
+class CameraProfiles:
+    def __init__(self, path):
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.profiles = json.load(f)
+    
+    def get(self, camera):
+        return self.profiles.get(camera)
+    
+    def put(self, camera, profile):
+        self.profiles[camera] = profile
+        with open(self.path, 'w') as f:
+            json.dump(self.profiles, f, indent=2)
+
+
+def measure_size_auto(path, profiles, img_original_scale=0.7, **kwargs):
+    camera = camera_id(path)
+    profile = profiles.get(camera)
+    
+    for attempt in range(2):
+        # No profile yet, or the cached one failed: search on a proxy.
+        if profile is None or attempt == 1:
+            profile = tune_profile(load_image(path, scale=img_original_scale))
+            if profile is None:
+                raise PaperNotFoundError(f'no paper quadrilateral found in {path}')
+            profiles.put(camera, profile)
+        try:
+            return measure_size(path, img_original_scale=img_original_scale,
+                                **dict(kwargs, **profile))
+        except PaperNotFoundError:    #4
+            if attempt == 1:
+                raise
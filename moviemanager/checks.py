@@ -0,0 +1,237 @@
+#runnable checks on synthetic audio with the offline recognizer: python checks.py [name ...]
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import wave
+import numpy as np
+import speech_recognition as sr
+from moviemanager import BACKENDS, FakeRecognizer, Moviemanager
+
+RATE=Moviemanager.RATE
+rng=np.random.default_rng(0)
+
+def at_level(x, db):
+    return x/np.sqrt((x**2).mean())*10**(db/20)
+
+def voiced(seconds, db=-20):
+    #harmonics of a gliding 140 Hz pitch, four syllables a second
+    t=np.arange(int(seconds*RATE))/RATE
+    phase=2*np.pi*np.cumsum(140+30*np.sin(2*np.pi*0.7*t))/RATE
+    x=sum(np.sin(h*phase)/h for h in range(1, 12))
+    return at_level(x*np.clip(np.sin(2*np.pi*4*t), 0, None)**0.5, db)
+
+def brown_noise(seconds, db=-42):
+    #integrated white noise with the slow drift removed: room rumble, no digital silence
+    x=np.cumsum(rng.standard_normal(int(seconds*RATE)))
+    x-=np.convolve(x, np.ones(RATE//10)/(RATE//10), 'same')
+    return at_level(x, db)
+
+def pcm(x):
+    return np.clip(x*32768, -32768, 32767).astype(np.int16)
+
+def write_wav(path, x):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(Moviemanager.SAMPLE_WIDTH)
+        f.setframerate(RATE)
+        f.writeframes(pcm(x).tobytes())
+    return path
+
+def speech_with_pauses(tmp, seconds=95):
+    #3 s of speech, 1 s of silence, so every segment has a cut point
+    x=np.concatenate([np.concatenate((voiced(3), np.zeros(RATE))) for _ in range(seconds//4+1)])
+    return write_wav(os.path.join(tmp, 'speech.wav'), x[:seconds*RATE])
+
+class FlakyRecognizer(FakeRecognizer):
+    #fails like a dropped connection or hears nothing, decided by the audio so threads do not matter
+    def recognize(self, audio, language):
+        text=FakeRecognizer.recognize(self, audio, language)
+        outcome=self.outcome(audio.frame_data)
+        if outcome=='error':
+            raise sr.RequestError('connection reset')
+        if outcome=='unknown':
+            raise sr.UnknownValueError()
+        return text
+
+    def outcome(self, pcm):
+        return ('error', 'unknown', 'text', 'text')[hashlib.sha256(pcm).digest()[0]%4]
+
+def check_segments_in_order(tmp):
+    mm=Moviemanager()
+    backend=FakeRecognizer(delay=0.01)
+    segments=mm.transcribe(speech_with_pauses(tmp), backend=backend, workers=4, max_seconds=10)
+    assert backend.calls==len(segments)>=10, (backend.calls, len(segments))
+    assert segments[0]['start']==0 and abs(segments[-1]['end']-95)<0.01, segments[-1]
+    for previous, segment in zip(segments, segments[1:]):
+        assert segment['start']==previous['end'], (previous, segment)
+    for segment in segments:
+        seconds=segment['end']-segment['start']
+        assert 5<=seconds<=10 or segment is segments[-1], segment
+        assert segment['text']=='<%.2fs castellano>' % seconds, segment
+
+def check_segments_run_in_parallel(tmp):
+    mm=Moviemanager()
+    path=speech_with_pauses(tmp)
+    backend=FakeRecognizer(delay=0.3)
+    started=time.perf_counter()
+    segments=mm.transcribe(path, backend=backend, workers=4, max_seconds=10)
+    elapsed=time.perf_counter()-started
+    assert elapsed<0.5*0.3*len(segments), (elapsed, len(segments))
+
+def check_failed_requests_are_marked(tmp):
+    mm=Moviemanager()
+    path=speech_with_pauses(tmp)
+    backend=FlakyRecognizer()
+    segments=mm.transcribe(path, backend=backend, workers=4, max_seconds=10)
+    outcomes=[backend.outcome(samples.tobytes()) for _, samples in mm.iter_segments(path, 10)]
+    assert len(set(outcomes))==3 and len(outcomes)==len(segments), outcomes
+    for outcome, segment in zip(outcomes, segments):
+        if outcome=='error':
+            assert segment['text']=='' and segment['error']=='connection reset', segment
+        elif outcome=='unknown':
+            assert segment['text']=='' and 'error' not in segment, segment
+        else:
+            assert segment['text'].startswith('<') and 'error' not in segment, segment
+
+class NoisyFfmpeg(Moviemanager):
+    #stands in for ffmpeg on a damaged file: megabytes of errors on stderr, then the audio
+    def __init__(self, tmp, seconds):
+        self.script=os.path.join(tmp, 'noisy_ffmpeg')
+        with open(self.script, 'w') as f:
+            f.write('#!%s\n'
+                    'import sys\n'
+                    'for i in range(50000):\n'
+                    '    sys.stderr.write("[mp3 @ 0x1] invalid packet %%d\\n" %% i)\n'
+                    'sys.stdout.buffer.write(bytes(%d))\n'
+                    % (sys.executable, seconds*RATE*self.SAMPLE_WIDTH))
+        os.chmod(self.script, 0o755)
+
+    def ffmpeg_binary(self):
+        return self.script
+
+def check_ffmpeg_errors_do_not_block(tmp):
+    mm=NoisyFfmpeg(tmp, 25)
+    chunks=[]
+    reader=threading.Thread(target=lambda: chunks.extend(mm.stream_pcm_chunks('damaged.mp4')),
+                            daemon=True)
+    reader.start()
+    reader.join(timeout=30)
+    assert not reader.is_alive(), 'decoder blocked on its error output'
+    assert sum(len(data) for data in chunks)==25*RATE*Moviemanager.SAMPLE_WIDTH, len(chunks)
+
+def check_vad_drops_room_noise(tmp):
+    #kept seconds, speech seconds over 30 s of -42 dBFS rumble
+    mm=Moviemanager()
+    noise=brown_noise(30)
+    for speech_seconds in (0, 1, 2):
+        x=noise.copy()
+        x[10*RATE:(10+speech_seconds)*RATE]+=voiced(speech_seconds)
+        kept=len(mm.drop_silence(pcm(x)))/RATE
+        assert speech_seconds<=kept<=speech_seconds+0.6, (speech_seconds, kept)
+    kept=len(mm.drop_silence(pcm(noise+voiced(30))))/RATE
+    assert kept>=29, kept
+    x=np.zeros(30*RATE)
+    x[10*RATE:12*RATE]=voiced(2)
+    kept=len(mm.drop_silence(pcm(x)))/RATE
+    assert 2<=kept<=2.6, kept
+
+def check_vad_skips_noise_in_transcribe(tmp):
+    mm=Moviemanager()
+    x=brown_noise(60)
+    x[20*RATE:22*RATE]+=voiced(2)
+    path=write_wav(os.path.join(tmp, 'noise.wav'), x)
+    backend=FakeRecognizer()
+    segments=mm.transcribe(path, backend=backend, workers=2, max_seconds=30, vad=True)
+    report=mm.vad_report(segments)
+    assert 2<=report['speech_seconds']<=2.6, report
+    assert backend.calls==1, backend.calls
+
+class OutageRecognizer(FakeRecognizer):
+    #the service goes down after up_calls requests in this process and stays down
+    name='outage'
+    up_calls=4
+    total_calls=0
+
+    def recognize(self, audio, language):
+        OutageRecognizer.total_calls+=1
+        text=FakeRecognizer.recognize(self, audio, language)
+        if OutageRecognizer.total_calls>self.up_calls:
+            raise sr.RequestError('quota exceeded')
+        return text
+
+def check_outage_stops_recognition(tmp):
+    #after the first failed segment nothing more is paid for, and the next run resumes there
+    mm=Moviemanager()
+    path=speech_with_pauses(tmp, 400)
+    n=len(list(mm.iter_segments(path, 10)))
+    output_dir=os.path.join(tmp, 'outage')
+    os.makedirs(output_dir, exist_ok=True)
+    BACKENDS['outage']=OutageRecognizer
+    try:
+        first=mm.transcribe_video(path, output_dir, backend_name='outage', workers=2,
+                                  max_seconds=10)
+        assert first['status']=='failed' and first['error']=='quota exceeded', first
+        assert OutageRecognizer.total_calls<=OutageRecognizer.up_calls+2*2+1<n, n
+        OutageRecognizer.up_calls=10**6
+        OutageRecognizer.total_calls=0
+        second=mm.transcribe_video(path, output_dir, backend_name='outage', workers=2,
+                                   max_seconds=10)
+    finally:
+        del BACKENDS['outage']
+        OutageRecognizer.up_calls=4
+    assert second['status']=='done' and second['segments']==n, second
+    assert 1<=second['resumed']<=4 and OutageRecognizer.total_calls==n-second['resumed'], second
+
+def check_resume_after_torn_log(tmp):
+    #a crash mid-write leaves half a line; resuming twice must keep every finished segment
+    mm=Moviemanager()
+    path=speech_with_pauses(tmp)
+    output_dir=os.path.join(tmp, 'resume')
+    os.makedirs(output_dir, exist_ok=True)
+    log_path=os.path.join(output_dir, 'speech.segments.jsonl')
+    txt_path=os.path.join(output_dir, 'speech.txt')
+    first=mm.transcribe_video(path, output_dir, backend_name='fake', max_seconds=10)
+    with open(txt_path) as f:
+        expected=f.read()
+    with open(log_path) as f:
+        lines=f.readlines()
+    with open(log_path, 'w') as f:
+        f.writelines(lines[:4])
+        f.write(lines[4][:len(lines[4])//2])
+    second=mm.transcribe_video(path, output_dir, backend_name='fake', max_seconds=10)
+    assert second['resumed']==3 and second['segments']==first['segments'], (first, second)
+    with open(log_path) as f:
+        records=[json.loads(line) for line in f]
+    assert len(records)==first['segments']+1, len(records)
+    third=mm.transcribe_video(path, output_dir, backend_name='fake', max_seconds=10)
+    assert third['resumed']==first['segments'] and third['status']=='done', third
+    with open(txt_path) as f:
+        assert f.read()==expected
+
+CHECKS=[check_segments_in_order, check_segments_run_in_parallel, check_failed_requests_are_marked,
+        check_ffmpeg_errors_do_not_block, check_vad_drops_room_noise,
+        check_vad_skips_noise_in_transcribe, check_outage_stops_recognition,
+        check_resume_after_torn_log]
+
+def main(names=None):
+    failed=0
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in CHECKS:
+            if names and check.__name__ not in names:
+                continue
+            try:
+                check(tmp)
+                print('ok    %s' % check.__name__)
+            except Exception:
+                failed+=1
+                print('FAIL  %s' % check.__name__)
+                traceback.print_exc()
+    return 1 if failed else 0
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,119 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
 import speech_recognition as sr
 from moviepy.editor import VideoFileClip, AudioFileClip
+
+class GoogleBackend:
+    #recognizer backends: a name and recognize(AudioData, language) -> str
+    name='google'
+
+    def __init__(self):
+        self.r=sr.Recognizer()
+
+    def recognize(self, audio, language):
+        return self.r.recognize_google(audio, language=language)
+
+class FakeRecognizer:
+    #offline backend for tests: text depends only on the audio, optional fake latency
+    name='fake'
+
+    def __init__(self, delay=0.0, delay_per_second=0.0):
+        self.delay=delay
+        self.delay_per_second=delay_per_second
+        self.calls=0
+
+    def recognize(self, audio, language):
+        self.calls+=1
+        seconds=len(audio.frame_data)/(audio.sample_rate*audio.sample_width)
+        time.sleep(self.delay+self.delay_per_second*seconds)
+        return '<%.2fs %s>' % (seconds, language)
+
+#backends by name, so batch jobs can build them inside worker processes
+BACKENDS={'google': GoogleBackend, 'fake': FakeRecognizer}
+
+class TranscriptCache:
+    #one small JSON file per segment, keyed by its PCM, language and backend
+    def __init__(self, directory, max_bytes=16*2**20):
+        self.directory=directory
+        self.max_bytes=max_bytes
+        self.hits=0
+        self.misses=0
+        self.lock=threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total=sum(entry.stat().st_size for entry in os.scandir(directory)
+                       if entry.name.endswith('.json'))
+
+    def key(self, pcm, rate, language, backend_name):
+        digest=hashlib.sha256(pcm)
+        digest.update(('|%d|%s|%s' % (rate, language, backend_name)).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        path=os.path.join(self.directory, key+'.json')
+        try:
+            with open(path) as f:
+                text=json.load(f)['text']
+            os.utime(path)    #mtime is the LRU clock
+        except (OSError, ValueError, KeyError):
+            with self.lock:
+                self.misses+=1
+            return None
+        with self.lock:
+            self.hits+=1
+        return text
+
+    def put(self, key, text):
+        path=os.path.join(self.directory, key+'.json')
+        tmp_path='%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump({'text': text}, f)
+        size=os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total+=size
+            if self.total<=self.max_bytes:
+                return
+            self.evict()
+
+    def evict(self):
+        #least recently used first, down to 90% of max_bytes so it does not run on every put
+        entries=[]
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat=entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.total=sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total<=0.9*self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total-=size
+
+    def stats(self):
+        lookups=self.hits+self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/lookups if lookups else 0.0,
+                'bytes': self.total}
+
 class Moviemanager:
+    #PCM format the recognizer gets: mono, 16 kHz, 16-bit little endian
+    RATE=16000
+    SAMPLE_WIDTH=2
+
     def get_wav_audio(self, mp4_file, wav_file):
         vc=VideoFileClip(mp4_file)
         ac=vc.audio
@@ -8,18 +121,353 @@ class Moviemanager:
         ac.close()
         vc.close()
 
-    def audio_to_text(self, audio_file):
+    def ffmpeg_binary(self):
+        #moviepy already depends on imageio-ffmpeg, which ships a static binary
+        try:
+            import imageio_ffmpeg
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError):
+            return 'ffmpeg'
+
+    def stream_pcm_chunks(self, mp4_file, chunk_seconds=10, rate=RATE):
+        #ffmpeg decodes, downmixes and resamples into a pipe, nothing touches the disk
+        cmd=[self.ffmpeg_binary(), '-nostdin', '-loglevel', 'error', '-i', mp4_file,
+             '-vn', '-ac', '1', '-ar', str(rate), '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+        proc=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        #stderr drained by a thread: a damaged file logs a line per bad packet and would fill the
+        #pipe, blocking ffmpeg while we block on stdout; only the last lines are kept
+        errors=deque(maxlen=20)
+        drain=threading.Thread(target=errors.extend, args=(proc.stderr,), daemon=True)
+        drain.start()
+        chunk_bytes=int(chunk_seconds*rate)*self.SAMPLE_WIDTH
+        try:
+            while True:
+                data=proc.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                yield data
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            drain.join()
+            proc.stderr.close()
+            proc.wait()
+            error=b''.join(errors).decode(errors='replace')
+        if proc.returncode!=0:
+            raise RuntimeError('ffmpeg failed on %s: %s' % (mp4_file, error.strip()))
+
+    def stream_audio_data(self, mp4_file, chunk_seconds=10, rate=RATE):
+        #the chunks wrapped as AudioData, ready for any recognize_* call
+        for data in self.stream_pcm_chunks(mp4_file, chunk_seconds, rate):
+            yield sr.AudioData(data, rate, self.SAMPLE_WIDTH)
+
+    def video_to_text_stream(self, mp4_file, language='castellano', chunk_seconds=10, backend=None):
+        #(start second, text) per chunk, the first one as soon as it is decoded
+        backend=backend or GoogleBackend()
+        for i, audio in enumerate(self.stream_audio_data(mp4_file, chunk_seconds)):
+            try:
+                text=backend.recognize(audio, language)
+            except (sr.UnknownValueError, sr.RequestError):
+                text='unknow'
+            yield i*chunk_seconds, text
+
+    def compare_extraction(self, mp4_file, wav_file, chunk_seconds=10):
+        #time to the first recognizable audio and disk used, WAV file vs pipe
+        start=time.perf_counter()
+        self.get_wav_audio(mp4_file, wav_file)
+        with sr.AudioFile(wav_file) as source:
+            sr.Recognizer().record(source, duration=chunk_seconds)
+        wav={'first_chunk_s': time.perf_counter()-start,
+             'peak_disk_bytes': os.path.getsize(wav_file)}
+        os.remove(wav_file)
+        start=time.perf_counter()
+        stream={'peak_disk_bytes': 0}
+        for i, chunk in enumerate(self.stream_pcm_chunks(mp4_file, chunk_seconds)):
+            if i==0:
+                stream['first_chunk_s']=time.perf_counter()-start
+        stream['total_s']=time.perf_counter()-start
+        return {'wav': wav, 'stream': stream}
+
+    def find_cut(self, samples, min_seconds, max_seconds, rate=RATE, frame_seconds=0.02):
+        #sample index of the quietest 20 ms frame between min_seconds and max_seconds
+        frame=int(rate*frame_seconds)
+        lo=int(min_seconds*rate)//frame
+        hi=min(len(samples), int(max_seconds*rate))//frame
+        lo=max(1, min(lo, hi-1))
+        frames=samples[:hi*frame].reshape(-1, frame).astype(np.float32)
+        energy=(frames[lo:]**2).mean(axis=1)
+        return (lo+int(np.argmin(energy)))*frame
+
+    def vad_mask(self, samples, rate=RATE, frame_seconds=0.02, margin_db=12, min_db=-60,
+                 zcr_max=0.35, hangover_seconds=0.2):
+        #speech frames: loud enough over the noise floor and not noise-like (hiss has zcr ~0.5)
+        frame=int(rate*frame_seconds)
+        n=len(samples)//frame
+        x=samples[:n*frame].astype(np.float32)/32768
+        frames=x.reshape(n, frame)
+        #energy after pre-emphasis: room rumble sits below the voice and would swamp the floor
+        emphasized=np.concatenate((x[:1], x[1:]-0.95*x[:-1])).reshape(n, frame)
+        energy_db=10*np.log10((emphasized**2).mean(axis=1)+1e-10)
+        zcr=np.diff(np.signbit(frames), axis=1).mean(axis=1)
+        floor, loud=np.percentile(energy_db, [10, 90]) if n else (0, 0)
+        if loud-floor<margin_db:
+            #a flat segment is steady noise, speech has pauses between words
+            threshold=max(min_db, floor+margin_db)
+        else:
+            #all-speech segments have no real floor, so the bar never goes above loud-margin
+            threshold=max(min_db, min(floor+margin_db, loud-margin_db))
+        speech=(energy_db>threshold)&(zcr<zcr_max)
+        #hangover: frames next to speech are kept so word edges are not clipped
+        k=int(hangover_seconds/frame_seconds)
+        if k and n:
+            speech=np.convolve(speech, np.ones(2*k+1), 'same')>0
+        return speech, frame
+
+    def drop_silence(self, samples, rate=RATE):
+        #only the speech samples, the spans between them removed
+        speech, frame=self.vad_mask(samples, rate)
+        if not len(speech):
+            return samples[:0]
+        keep=np.repeat(speech, frame)
+        keep=np.concatenate((keep, np.full(len(samples)-len(keep), speech[-1])))
+        return samples[keep]
+
+    def vad_report(self, segments):
+        audio=sum(segment['end']-segment['start'] for segment in segments)
+        speech=sum(segment['speech_seconds'] for segment in segments)
+        return {'audio_seconds': audio,
+                'speech_seconds': speech,
+                'skipped_fraction': 1-speech/audio if audio else 0.0}
+
+    def iter_segments(self, audio_file, max_seconds=30, min_seconds=5, rate=RATE):
+        #(start sample, int16 samples) of at most max_seconds, cut at silence
+        max_len=int(max_seconds*rate)
+        buffer=np.empty(0, dtype=np.int16)
+        start=0
+        for data in self.stream_pcm_chunks(audio_file, min(10, max_seconds), rate):
+            buffer=np.concatenate((buffer, np.frombuffer(data, dtype='<i2')))
+            while len(buffer)>=max_len:
+                cut=self.find_cut(buffer, min_seconds, max_seconds, rate)
+                yield start, buffer[:cut]
+                start+=cut
+                buffer=buffer[cut:]
+        if len(buffer):
+            yield start, buffer
+
+    def recognize_segment(self, backend, start, samples, language, rate=RATE, cache=None,
+                          vad=False):
+        segment={'start': start/rate, 'end': (start+len(samples))/rate}
+        if vad:
+            samples=self.drop_silence(samples, rate)
+        segment['speech_seconds']=len(samples)/rate
+        if not len(samples):
+            segment['text']=''
+            return segment
+        pcm=samples.tobytes()
+        if cache is not None:
+            key=cache.key(pcm, rate, language, backend.name)
+            text=cache.get(key)
+            if text is not None:
+                segment['text']=text
+                segment['cached']=True
+                return segment
+        try:
+            segment['text']=backend.recognize(sr.AudioData(pcm, rate, self.SAMPLE_WIDTH), language)
+        except sr.UnknownValueError:
+            segment['text']=''
+        except sr.RequestError as e:
+            segment['text']=''
+            segment['error']=str(e)
+            return segment    #failed requests are not cached
+        if cache is not None:
+            cache.put(key, segment['text'])
+        return segment
+
+    def transcribe(self, audio_file, language='castellano', backend=None, workers=4,
+                   max_seconds=30, min_seconds=5, cache=None, vad=False, skip=0,
+                   on_segment=None, stop=None):
+        #segments recognized concurrently, returned in order with their timestamps
+        #skip: segments already done (decoded again, not recognized); on_segment: called in order
+        #stop: an Event; once set nothing more is submitted and queued segments are cancelled
+        backend=backend or GoogleBackend()
+        segments=[]
+        pending=deque()
+
+        def collect(future):
+            if future.cancelled():
+                return
+            segment=future.result()
+            segments.append(segment)
+            if on_segment is not None:
+                on_segment(segment)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, (start, samples) in enumerate(self.iter_segments(audio_file, max_seconds, min_seconds)):
+                if i<skip:
+                    continue
+                if stop is not None and stop.is_set():
+                    break
+                pending.append(pool.submit(self.recognize_segment, backend, start, samples,
+                                           language, cache=cache, vad=vad))
+                #at most 2 segments per worker held in memory
+                if len(pending)>=2*workers:
+                    collect(pending.popleft())
+            while pending:
+                if stop is not None and stop.is_set():
+                    for future in pending:
+                        future.cancel()
+                collect(pending.popleft())
+        return segments
+
+    def transcribe_video(self, mp4_file, output_dir, language='castellano', backend_name='google',
+                         workers=4, max_seconds=30, cache_dir=None, vad=False):
+        #one video with a segment log, so an interrupted run resumes at the first missing segment
+        stem=os.path.splitext(os.path.basename(mp4_file))[0]
+        log_path=os.path.join(output_dir, stem+'.segments.jsonl')
+        stat=os.stat(mp4_file)
+        header={'source': os.path.abspath(mp4_file), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                'language': language, 'backend': backend_name, 'max_seconds': max_seconds,
+                'vad': vad}
+        done=self.read_segment_log(log_path, header)
+        resumed=len(done)
+        #rewritten before appending, so a half-written line from a crash is not left in the middle
+        self.write_segment_log(log_path, header, done)
+        cache=TranscriptCache(cache_dir) if cache_dir else None
+        failed=[]
+        stop=threading.Event()
+        with open(log_path, 'a') as log:
+            def checkpoint(segment):
+                #only an unbroken run of good segments is logged, the rest is retried next time;
+                #after a failure (outage, quota) no more segments are sent to the recognizer
+                if 'error' in segment or failed:
+                    failed.append(segment)
+                    stop.set()
+                    return
+                log.write(json.dumps(segment)+'\n')
+                log.flush()
+            segments=self.transcribe(mp4_file, language, BACKENDS[backend_name](), workers,
+                                     max_seconds, cache=cache, vad=vad, skip=len(done),
+                                     on_segment=checkpoint, stop=stop)
+        segments=done+segments
+        result={'file': mp4_file, 'segments': len(segments), 'resumed': resumed,
+                'status': 'failed' if failed else 'done'}
+        if failed:
+            result['error']=next(s['error'] for s in failed if 'error' in s)
+            return result
+        with open(os.path.join(output_dir, stem+'.txt'), 'w') as f:
+            for segment in segments:
+                if segment['text']:
+                    f.write('[%8.2f - %8.2f] %s\n' % (segment['start'], segment['end'], segment['text']))
+        if vad:
+            result.update(self.vad_report(segments))
+        return result
+
+    def read_segment_log(self, log_path, header):
+        #segments of a previous run, if it was for the same file and settings
+        try:
+            with open(log_path) as f:
+                lines=f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        segments=[]
+        try:
+            if json.loads(lines[0])!=header:
+                return []
+            for line in lines[1:]:
+                segments.append(json.loads(line))
+        except (IndexError, ValueError):
+            pass    #a half-written last line from a crash
+        return segments
+
+    def write_segment_log(self, log_path, header, segments):
+        tmp_path=log_path+'.tmp'
+        with open(tmp_path, 'w') as f:
+            for record in [header]+segments:
+                f.write(json.dumps(record)+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, log_path)
+
+    def transcribe_directory(self, directory, output_dir=None, processes=2, workers=4,
+                             language='castellano', backend_name='google', max_seconds=30,
+                             cache_dir=None, vad=False, pattern='*.mp4'):
+        #every video in a process pool; the manifest is rewritten after each finished file
+        output_dir=output_dir or os.path.join(directory, 'transcripts')
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path=os.path.join(output_dir, 'manifest.json')
+        manifest=self.read_manifest(manifest_path)
+        videos=sorted(glob.glob(os.path.join(directory, pattern)))
+        todo=[video for video in videos
+              if manifest.get(os.path.basename(video), {}).get('status')!='done'
+              or manifest[os.path.basename(video)].get('mtime')!=os.stat(video).st_mtime]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures={pool.submit(transcribe_video_job, (video, output_dir, language, backend_name,
+                                                        workers, max_seconds, cache_dir, vad)): video
+                     for video in todo}
+            for future in as_completed(futures):
+                video=futures[future]
+                try:
+                    result=future.result()
+                except Exception as e:
+                    result={'file': video, 'status': 'failed', 'error': '%s: %s' % (type(e).__name__, e)}
+                result['mtime']=os.stat(video).st_mtime
+                manifest[os.path.basename(video)]=result
+                self.write_manifest(manifest_path, manifest)
+        return manifest
+
+    def read_manifest(self, manifest_path):
+        try:
+            with open(manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def write_manifest(self, manifest_path, manifest):
+        #atomic replace: a crash leaves the previous manifest, never half of one
+        tmp_path=manifest_path+'.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+
+    def audio_to_text(self, audio_file, language='castellano', chunked=False, backend=None,
+                      workers=4, max_seconds=30, cache=None, vad=False):
+        if chunked:
+            segments=self.transcribe(audio_file, language, backend, workers, max_seconds,
+                                     cache=cache, vad=vad)
+            return ' '.join(segment['text'] for segment in segments if segment['text'])
+        backend=backend or GoogleBackend()
         r=sr.Recognizer()
         with sr.AudioFile(audio_file) as source:
             audio=r.record(source)
         try:
-            text=r.recognize_google(audio, language='castellano')
+            text=backend.recognize(audio, language)
             return text
         except:
             return 'unknow'
         
     
-mm=Moviemanager()
-#mm.get_wav_audio('video.mp4', 'audio.wav')
-speech=mm.audio_to_text('audio.wav')
-print(speech)
\ No newline at end of file
+def transcribe_video_job(job):
+    #module level so the process pool can pickle it
+    return Moviemanager().transcribe_video(*job)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Transcribe every MP4 in a directory, resumable.')
+    parser.add_argument('directory')
+    parser.add_argument('-o', '--output', help='transcripts and manifest (default: DIRECTORY/transcripts)')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=4, help='recognition threads per video')
+    parser.add_argument('--language', default='castellano')
+    parser.add_argument('--backend', default='google', choices=sorted(BACKENDS))
+    parser.add_argument('--max-seconds', type=float, default=30)
+    parser.add_argument('--cache', help='transcript cache directory')
+    parser.add_argument('--vad', action='store_true')
+    args=parser.parse_args()
+    mm=Moviemanager()
+    manifest=mm.transcribe_directory(args.directory, args.output, args.processes, args.workers,
+                                     args.language, args.backend, args.max_seconds, args.cache,
+                                     args.vad)
+    for name, result in sorted(manifest.items()):
+        print(name, result['status'], result.get('error', ''))
\ No newline at end of file